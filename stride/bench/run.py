@@ -0,0 +1,246 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from ..corpus import Corpus, Entry
+from ..db import NGramDBMulti
+from ..ngram import build_ngram_dbs
+from ..predict import predict_multi
+from ..vocab import Vocab
+from . import synth
+
+
+def peak_rss_mb() -> float:
+    '''Peak resident set size so far of this process or its largest (pool worker) child.'''
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)
+
+
+def _commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(__file__), stderr=subprocess.DEVNULL
+        ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _best(fn, repeat: int):
+    '''Returns (best seconds, last result) of repeat calls of fn.'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, res
+
+
+class Bench(object):
+    '''Collects the results of each stage along with the peak RSS after it.'''
+    def __init__(self, repeat: int = 3):
+        self.repeat = repeat
+        self.results = {}
+
+    def stage(self, name: str, fn, items: int, unit: str):
+        seconds, res = _best(fn, self.repeat)
+        self.results[name] = {
+            'seconds': seconds,
+            unit: items / seconds if seconds > 0 else float('inf'),
+            'peak_rss_mb': peak_rss_mb(),
+        }
+        print('%-20s %10.4fs %14.1f %s' % (name, seconds, self.results[name][unit], unit), file=sys.stderr)
+        return res
+
+
+def check_baseline(preds, path: str) -> dict:
+    '''Compares predictions against a stored baseline, or stores them if there is none yet.'''
+    if not os.path.exists(path):
+        with open(path, 'w') as f:
+            json.dump(preds, f)
+        return {'baseline': path, 'functions': len(preds), 'written': True}
+
+    with open(path, 'r') as f:
+        base = json.load(f)
+
+    mismatches = sum(a != b for a, b in zip(preds, base)) + abs(len(preds) - len(base))
+    return {'baseline': path, 'functions': len(preds), 'mismatches': mismatches, 'equivalent': mismatches == 0}
+
+
+def run(args, workdir: str) -> dict:
+    config = {
+        'train': args.train,
+        'test': args.test,
+        'length': args.length,
+        'var_density': args.var_density,
+        'vocab_size': args.vocab_size,
+        'templates': args.templates,
+        'seed': args.seed,
+        'sizes': args.sizes,
+        'topk': args.topk,
+        'flanking': args.flanking,
+        'lookups': args.lookups,
+    }
+
+    # Train and test are drawn from the same template pool
+    functions = synth.generate(args.train + args.test, args.length, args.var_density, args.vocab_size, args.templates, seed=args.seed)
+    train_path = os.path.join(workdir, 'train.jsonl')
+    synth.write(functions[:args.train], train_path)
+    test = functions[args.train:]
+    del functions
+
+    bench = Bench(args.repeat)
+    corpus = Corpus(train_path)
+
+    vocab = bench.stage('build_vocab', lambda: Vocab.build_vocab(corpus, 'name'), args.train, 'functions_per_sec')
+
+    dbs = bench.stage(
+        'build_ngram_db_multi',
+        lambda: build_ngram_dbs(corpus, vocab, 'name', args.sizes, args.topk, args.flanking),
+        args.train, 'functions_per_sec',
+    )
+
+    paths = []
+    for db in dbs:
+        path = os.path.join(workdir, 'ngram.%d.db' % db.size)
+        db.save(path)
+        paths.append(path)
+    db_bytes = {str(db.size): os.path.getsize(path) for db, path in zip(dbs, paths)}
+    del dbs
+
+    dbs = bench.stage('load', lambda: [NGramDBMulti.load(path) for path in paths], len(paths), 'dbs_per_sec')
+    bench.stage('load_mmap', lambda: [NGramDBMulti.load(path, mmap=True) for path in paths], len(paths), 'dbs_per_sec')
+
+    # Half of the queries hit (sampled from the database), half are random misses
+    rng = np.random.default_rng(args.seed)
+    queries = []
+    for db in dbs:
+        hits = db.hsh[rng.integers(0, len(db.hsh), args.lookups // 2)] if len(db.hsh) > 0 else np.zeros(0, dtype='|S12')
+        misses = np.frombuffer(rng.bytes(12 * (args.lookups - len(hits))), dtype='|S12')
+        q = np.concatenate([hits, misses])
+        rng.shuffle(q)
+        queries.append(q)
+
+    nscalar = min(args.lookups, 10000)
+    bench.stage(
+        'lookup',
+        lambda: [db.lookup(k) for db, q in zip(dbs, queries) for k in q[:nscalar].tolist()],
+        nscalar * len(dbs), 'lookups_per_sec',
+    )
+    bench.stage(
+        'lookup_many',
+        lambda: [db.lookup_many(q) for db, q in zip(dbs, queries)],
+        sum(len(q) for q in queries), 'lookups_per_sec',
+    )
+
+    # Fresh entries each repeat, so token normalization is included
+    def iter_ngrams():
+        for raw in test:
+            entry = Entry(raw)
+            for size in args.sizes:
+                for _ in entry.iter_ngrams(size, args.flanking):
+                    pass
+
+    bench.stage('iter_ngrams', iter_ngrams, args.test, 'functions_per_sec')
+
+    # All sizes in one pass, as the build and predict_multi hash them
+    def iter_ngram_hashes():
+        for raw in test:
+            entry = Entry(raw)
+            for _ in entry.iter_ngram_hashes(args.sizes, args.flanking):
+                pass
+
+    bench.stage('iter_ngram_hashes', iter_ngram_hashes, args.test, 'functions_per_sec')
+
+    preds = bench.stage(
+        'predict_multi',
+        lambda: [predict_multi(Entry(raw), vocab, dbs, 'name', args.flanking) for raw in test],
+        args.test, 'functions_per_sec',
+    )
+
+    report = {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'config': config,
+        'results': bench.results,
+        'db_bytes': db_bytes,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+    if args.baseline is not None:
+        report['equivalence'] = check_baseline(preds, args.baseline)
+
+    return report
+
+
+def compare(old: dict, new: dict):
+    '''Prints the change of every rate between two reports (> 1 is faster).'''
+    for stage, res in new['results'].items():
+        prev = old['results'].get(stage)
+        if prev is None:
+            continue
+        for key, value in res.items():
+            if key.endswith('_per_sec') and prev.get(key):
+                print('%-20s %-18s %8.2fx' % (stage, key, value / prev[key]), file=sys.stderr)
+
+
+def main(args):
+    args.sizes = [int(x) for x in args.sizes.split(',')]
+
+    if args.workdir is not None:
+        os.makedirs(args.workdir, exist_ok=True)
+        report = run(args, args.workdir)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            report = run(args, workdir)
+
+    data = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(data)
+    else:
+        print(data)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            compare(json.load(f), report)
+
+    if not report.get('equivalence', {}).get('equivalent', True):
+        print('Predictions differ from the baseline in %d functions' % report['equivalence']['mismatches'], file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks STRIDE on a synthetic corpus')
+    parser.add_argument('--output', '-o', default=None, help='Path to write the JSON report (default: stdout)')
+    parser.add_argument('--baseline', default=None, help='Predictions to check against (written if missing)')
+    parser.add_argument('--compare', default=None, help='Previous JSON report to print speedups against')
+    parser.add_argument('--workdir', default=None, help='Keep the generated corpus and databases here (default: temp dir)')
+    parser.add_argument('--train', type=int, default=20000, help='Number of training functions')
+    parser.add_argument('--test', type=int, default=2000, help='Number of test functions')
+    parser.add_argument('--length', type=int, default=120, help='Mean function length in tokens')
+    parser.add_argument('--var-density', type=float, default=0.1, help='Fraction of tokens which are variables')
+    parser.add_argument('--vocab-size', type=int, default=1000, help='Number of distinct name labels')
+    parser.add_argument('--templates', type=int, default=500, help='Number of distinct template functions')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sizes', default='10,5,3,2', help='Comma separated N-gram sizes')
+    parser.add_argument('--topk', type=int, default=5)
+    parser.add_argument('--flanking', '-f', action='store_true', default=False)
+    parser.add_argument('--lookups', type=int, default=100000, help='Number of lookups per database')
+    parser.add_argument('--repeat', type=int, default=3, help='Repetitions per stage (the best is reported)')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,147 @@
+import argparse
+import json
+import random
+from typing import Dict, List
+
+
+KEYWORDS = [
+    'if', 'else', 'while', 'for', 'do', 'return', 'break', 'goto', 'sizeof',
+    'int', 'uint', 'char', 'long', 'ulong', 'undefined4', 'undefined8', 'void', 'bool',
+]
+
+OPERATORS = [
+    '(', ')', '{', '}', '[', ']', ';', ',', '*', '&', '+', '-', '=', '==', '!=',
+    '<', '<=', '>', '>>', '<<', '&&', '||', '->', '.', '+=', '!',
+]
+
+TYPES = [
+    'int', 'char *', 'void *', 'size_t', 'long', 'unsigned int', 'char', 'struct node *',
+    'FILE *', 'uint8_t *', 'int *', 'double', 'bool', 'struct ctx *', 'const char *',
+]
+
+
+def _literal(rng: random.Random) -> str:
+    '''A decompiler style identifier or constant (exercises the normalizer).'''
+    kind = rng.randrange(8)
+    if kind == 0:
+        return '0x%x' % rng.randrange(1 << 16)
+    elif kind == 1:
+        return str(rng.randrange(1000))
+    elif kind == 2:
+        return 'local_%x' % rng.randrange(8, 0x200, 8)
+    elif kind == 3:
+        return 'DAT_%08x' % rng.randrange(0x400000, 0x500000)
+    elif kind == 4:
+        return 'FUN_%08x' % rng.randrange(0x400000, 0x500000)
+    elif kind == 5:
+        return '%sVar%d' % (rng.choice('iupbc'), rng.randrange(1, 12))
+    elif kind == 6:
+        return 's_%s_%08x' % (rng.choice(['error', 'usage', 'ok', 'fmt']), rng.randrange(0x400000, 0x500000))
+    else:
+        return rng.choice(['memcpy', 'strlen', 'malloc', 'free', 'printf', 'fopen', 'read', 'write'])
+
+
+def _token(rng: random.Random) -> str:
+    r = rng.random()
+    if r < 0.5:
+        return rng.choice(OPERATORS)
+    elif r < 0.7:
+        return rng.choice(KEYWORDS)
+    return _literal(rng)
+
+
+def _zipf_index(rng: random.Random, n: int) -> int:
+    '''Skewed choice in [0, n), like the label distribution of real corpora.'''
+    return min(n - 1, int(n ** rng.random()) - 1)
+
+
+def generate(
+    count: int,
+    mean_length: int = 120,
+    var_density: float = 0.1,
+    vocab_size: int = 1000,
+    templates: int = 500,
+    mutation: float = 0.05,
+    human: float = 0.9,
+    seed: int = 0,
+) -> List[Dict]:
+    '''
+    Generates functions in the STRIDE corpus format written by the converters.
+
+    Functions are mutated copies of a pool of template functions, so N-gram
+    contexts repeat across the corpus the way library and inlined code does in
+    real datasets. mean_length is the mean number of tokens, var_density the
+    fraction of tokens which are variables and vocab_size the number of
+    distinct name labels. The output only depends on the arguments.
+    '''
+    rng = random.Random(seed)
+    names = ['name%d' % i for i in range(vocab_size)]
+
+    pool = []
+    for _ in range(templates):
+        length = max(3, int(rng.expovariate(1 / mean_length)))
+        nvars = max(1, int(length * var_density / 3))
+        tokens = [
+            '@@var_%d@@' % rng.randrange(nvars) if rng.random() < var_density else _token(rng)
+            for _ in range(length)
+        ]
+        labels = {
+            'var_%d' % i: (names[_zipf_index(rng, vocab_size)], rng.choice(TYPES))
+            for i in range(nvars)
+        }
+        pool.append((tokens, labels))
+
+    out = []
+    for k in range(count):
+        tokens, labels = pool[_zipf_index(rng, len(pool))]
+        tokens = [x if x.startswith('@@') or rng.random() >= mutation else _token(rng) for x in tokens]
+
+        name_info = {}
+        type_info = {}
+        for var in sorted(set(x[2:-2] for x in tokens if x.startswith('@@') and x.endswith('@@'))):
+            name, typ = labels[var]
+            if rng.random() < mutation:
+                name = names[_zipf_index(rng, vocab_size)]
+            is_human = rng.random() < human
+            name_info[var] = {'label': name if is_human else '<none>', 'human': is_human}
+            type_info[var] = {'label': typ if is_human else '<none>', 'human': is_human}
+
+        out.append({
+            'tokens': tokens,
+            'labels': {
+                'name': name_info,
+                'type': type_info,
+            },
+            'meta': {
+                'id': k,
+                'fit': rng.random() < 0.5,
+            },
+        })
+
+    return out
+
+
+def write(functions: List[Dict], path: str):
+    with open(path, 'w') as f:
+        for fn in functions:
+            f.write(json.dumps(fn) + '\n')
+
+
+def main(args):
+    functions = generate(args.count, args.length, args.var_density, args.vocab_size, args.templates, args.mutation, seed=args.seed)
+    write(functions, args.output)
+    print('Wrote %d functions to %s' % (len(functions), args.output))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generates a synthetic corpus in STRIDE format')
+    parser.add_argument('output', help='Path to output.jsonl')
+    parser.add_argument('--count', '-n', type=int, default=10000, help='Number of functions')
+    parser.add_argument('--length', type=int, default=120, help='Mean function length in tokens')
+    parser.add_argument('--var-density', type=float, default=0.1, help='Fraction of tokens which are variables')
+    parser.add_argument('--vocab-size', type=int, default=1000, help='Number of distinct name labels')
+    parser.add_argument('--templates', type=int, default=500, help='Number of distinct template functions')
+    parser.add_argument('--mutation', type=float, default=0.05, help='Probability of replacing each token of a template')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    main(args)
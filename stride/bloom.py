@@ -0,0 +1,67 @@
+import math
+
+import numpy as np
+
+
+def _probes(keys):
+    '''
+    Splits 12-byte keys into the two 64-bit values used for double hashing.
+    The keys are already uniformly distributed SHA-256 prefixes, so no
+    further hashing is needed.
+    '''
+    raw = np.ascontiguousarray(keys).view(np.uint8).reshape(-1, 12)
+    h1 = np.ascontiguousarray(raw[:, :8]).view('<u8').ravel()
+    h2 = np.ascontiguousarray(raw[:, 8:]).view('<u4').ravel().astype(np.uint64) | np.uint64(1)
+    return h1, h2
+
+
+class BloomFilter(object):
+    '''
+    Bloom filter over N-gram hashes, used to reject most misses before the
+    sorted-array search. Probe i of a key is (h1 + i * h2) mod nbits.
+    '''
+    def __init__(self, words, k: int):
+        self.words = words
+        self.k = int(k)
+        self.nbits = np.uint64(len(words) * 64)
+
+    def __repr__(self):
+        return f'BloomFilter(bits={int(self.nbits)}, k={self.k})'
+
+    @property
+    def nbytes(self) -> int:
+        return self.words.nbytes
+
+    @staticmethod
+    def build(keys, bits_per_key: float = 10) -> 'BloomFilter':
+        keys = np.asarray(keys, dtype='|S12')
+
+        nwords = max(1, int(math.ceil(len(keys) * bits_per_key / 64)))
+        k = max(1, int(round(bits_per_key * math.log(2))))
+        bf = BloomFilter(np.zeros(nwords, dtype=np.uint64), k)
+
+        h1, h2 = _probes(keys)
+        for i in range(k):
+            bit = (h1 + np.uint64(i) * h2) % bf.nbits
+            np.bitwise_or.at(bf.words, bit >> np.uint64(6), np.uint64(1) << (bit & np.uint64(63)))
+
+        return bf
+
+    def contains_many(self, keys):
+        '''Returns a mask of keys which may be present (no false negatives).'''
+        keys = np.asarray(keys, dtype='|S12')
+        h1, h2 = _probes(keys)
+
+        out = np.ones(len(keys), dtype=bool)
+        cand = np.arange(len(keys))
+        for i in range(self.k):
+            bit = (h1[cand] + np.uint64(i) * h2[cand]) % self.nbits
+            present = (self.words[bit >> np.uint64(6)] >> (bit & np.uint64(63))) & np.uint64(1)
+
+            miss = present == 0
+            out[cand[miss]] = False
+            cand = cand[~miss]
+            if len(cand) == 0:
+                break
+
+        return out
@@ -0,0 +1,108 @@
+from collections import OrderedDict
+import hashlib
+import json
+import sqlite3
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .corpus import Entry
+from .db import NGramDBMulti
+from .vocab import Vocab
+
+
+def fingerprint(vocab: Vocab, dbs: List[NGramDBMulti], label: str, flanking: bool, full_strip: bool = False, block: int = 1 << 20) -> bytes:
+    '''
+    Fingerprints everything a prediction depends on besides the function.
+    Every row of every database is hashed, block by block so memory-mapped
+    databases are not read into memory at once. Compute it once per run.
+    '''
+    h = hashlib.sha256()
+    h.update(json.dumps([label, flanking, full_strip]).encode('utf-8'))
+
+    for e, c in zip(vocab.entries, vocab.counts):
+        h.update(e.encode('utf-8') + b'\xff' + str(c).encode('utf-8') + b'\x00')
+
+    # Layered databases are fingerprinted layer by layer
+    dbs = [layer for db in dbs for layer in getattr(db, 'layers', [db])]
+
+    for db in dbs:
+        arrs = [db.hsh, db.total, db.typ, db.counts]
+        h.update(json.dumps([db.sizes] + [[str(a.dtype), list(a.shape)] for a in arrs]).encode('utf-8'))
+        for arr in arrs:
+            for i in range(0, len(arr), block):
+                h.update(np.ascontiguousarray(arr[i:i+block]).tobytes())
+
+    return h.digest()
+
+
+def function_key(entry: Entry) -> bytes:
+    '''Content hash of a function: its normalized tokens and variable names.'''
+    h = hashlib.sha256()
+    h.update(b'\xff'.join(tok.encode('utf-8') for tok in entry.stripped_tokens))
+    h.update(b'\x00')
+    h.update(b'\xff'.join(entry.tokens[i].encode('utf-8') for i in entry.var_positions))
+    return h.digest()
+
+
+class PredictionCache(object):
+    '''
+    Caches predict_multi results for identical functions.
+
+    Keys combine function_key with a fingerprint of the vocab, databases and
+    settings. Results live in an in-process LRU and, if path is given, in a
+    sqlite database shared between processes and runs.
+    '''
+    def __init__(self, fingerprint: bytes, max_entries: int = 10000, path: str = None):
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self.lru = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS preds (key BLOB PRIMARY KEY, value TEXT)')
+
+    def key(self, entry: Entry) -> bytes:
+        return hashlib.sha256(self.fingerprint + function_key(entry)).digest()
+
+    def get(self, key: bytes) -> Optional[Dict[str, str]]:
+        if key in self.lru:
+            self.lru.move_to_end(key)
+            self.hits += 1
+            return self.lru[key]
+
+        if self.db is not None:
+            row = self.db.execute('SELECT value FROM preds WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                value = json.loads(row[0])
+                self._remember(key, value)
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key: bytes, value: Dict[str, str]):
+        self._remember(key, value)
+        if self.db is not None:
+            self.db.execute('INSERT OR REPLACE INTO preds (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+
+    def _remember(self, key: bytes, value: Dict[str, str]):
+        if self.max_entries <= 0:
+            return
+
+        self.lru[key] = value
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.max_entries:
+            self.lru.popitem(last=False)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -0,0 +1,55 @@
+import http.client
+import json
+import socket
+from typing import Dict, List
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float = None):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class StrideClient(object):
+    '''
+    Client for stride.server. Keeps one persistent connection, so an instance
+    should not be shared between threads.
+
+    Functions are dicts in STRIDE corpus format (only 'tokens' is required).
+    '''
+    def __init__(self, host: str = '127.0.0.1', port: int = 8765, unix: str = None, timeout: float = 60):
+        if unix is not None:
+            self.conn = _UnixHTTPConnection(unix, timeout=timeout)
+        else:
+            self.conn = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _request(self, method: str, path: str, body: Dict = None) -> Dict:
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        headers = {'Content-Type': 'application/json'} if data is not None else {}
+
+        self.conn.request(method, path, body=data, headers=headers)
+        res = self.conn.getresponse()
+        out = json.loads(res.read())
+
+        if res.status != 200:
+            raise RuntimeError('stride server error %d: %s' % (res.status, out.get('error')))
+        return out
+
+    def health(self) -> Dict:
+        return self._request('GET', '/health')
+
+    def predict(self, functions: List[Dict]) -> List[Dict[str, str]]:
+        '''Returns one {var: prediction} dict per function.'''
+        return self._request('POST', '/predict', {'functions': functions})['predictions']
+
+    def predict_one(self, function: Dict) -> Dict[str, str]:
+        return self.predict([function])[0]
+
+    def close(self):
+        self.conn.close()
@@ -1,10 +1,8 @@
 
 import argparse
 import json
-from pathlib import Path
-import tarfile
 
-from tqdm.auto import tqdm
+from .shards import convert_dataset
 
 
 def _get_dire_varmap(node, vmap):
@@ -68,44 +66,16 @@ def convert_one(info, is_test=False):
     return json.dumps(out)
 
 
-def load_files(files, is_test=False):
-    out = []
-
-    for file in tqdm(files):
-        t = tarfile.open(file)
-        for member in tqdm(t.getmembers()):
-            b = member.name.split('_')[0]
-
-            data = t.extractfile(member).read()
-            data = data.decode('ascii').strip().split('\n')
-            for line in data:
-                info = json.loads(line)
-
-                entry = convert_one(info, is_test=is_test)
-                out.append(entry)
-
-    return out
-
-
 def main(args):
-    train = list(Path(args.input).glob('train-shard-*.tar'))
-    test = [Path(args.input) / 'test.tar']
-    
-    train = load_files(train)
-    test = load_files(test, is_test=True)
-
-    with open(Path(args.output) / 'converted_train.jsonl', 'w') as f:
-        f.write('\n'.join(train))
-
-    with open(Path(args.output) / 'converted_test.jsonl', 'w') as f:
-        f.write('\n'.join(test))
-
-    print('Wrote %d train and %d test entries to %s' % (len(train), len(test), args.output))
+    train, test = convert_dataset(convert_one, args.input, args.output, args.nproc, args.shards)
+    print('Wrote %d train and %d test entries to %s' % (train, test, args.output))
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('input', help='Path to DIRE input folder')
     parser.add_argument('output', help='Path to output folder')
+    parser.add_argument('--nproc', '-p', type=int, default=None, help='Number of processes')
+    parser.add_argument('--shards', type=int, default=1, help='Split the converted train set into this many files')
     args = parser.parse_args()
     main(args)
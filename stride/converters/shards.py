@@ -0,0 +1,83 @@
+import json
+import multiprocessing
+from pathlib import Path
+import re
+import shutil
+import tarfile
+import tempfile
+from typing import Callable, List
+
+from tqdm.auto import tqdm
+
+
+def _shard_key(path: Path):
+    '''Sorts train-shard-2.tar before train-shard-10.tar.'''
+    return [int(x) if x.isdigit() else x for x in re.split(r'(\d+)', path.name)]
+
+
+def _convert_tar(job) -> int:
+    '''Converts every record of one tar file into a part file. Runs in a worker process.'''
+    convert_one, path, out_path, is_test = job
+
+    count = 0
+    # Stream mode reads members in archive order without building an index first
+    with tarfile.open(path, 'r|*') as t, open(out_path, 'w') as f:
+        for member in t:
+            if not member.isfile():
+                continue
+
+            for line in t.extractfile(member):
+                line = line.decode('ascii')
+                if line.strip() == '':
+                    continue
+                f.write(convert_one(json.loads(line), is_test=is_test) + '\n')
+                count += 1
+
+    return count
+
+
+def _concat(parts: List[Path], out_path: Path):
+    with open(out_path, 'w') as f:
+        for part in parts:
+            with open(part, 'r') as p:
+                shutil.copyfileobj(p, f)
+
+
+def convert_dataset(convert_one: Callable, input: str, output: str, nproc: int = None, shards: int = 1):
+    '''
+    Converts train-shard-*.tar and test.tar in input to converted_train.jsonl
+    and converted_test.jsonl in output.
+
+    Each tar file is converted in a worker process which streams its records
+    to a part file, so memory does not grow with the dataset. The parts are
+    then concatenated in shard order, which makes the output identical
+    across runs. With shards > 1 the train set is instead written to
+    converted_train.00000.jsonl, ... (contiguous groups of input shards).
+    '''
+    train = sorted(Path(input).glob('train-shard-*.tar'), key=_shard_key)
+    test = Path(input) / 'test.tar'
+
+    tmp = Path(tempfile.mkdtemp(prefix='.parts-', dir=output))
+    try:
+        train_parts = [tmp / ('train.%05d.jsonl' % i) for i in range(len(train))]
+        test_part = tmp / 'test.jsonl'
+
+        jobs = [(convert_one, path, part, False) for path, part in zip(train, train_parts)]
+        jobs.append((convert_one, test, test_part, True))
+
+        with multiprocessing.Pool(processes=nproc) as pool:
+            counts = list(tqdm(pool.imap(_convert_tar, jobs), total=len(jobs), desc='Converting'))
+
+        if shards > 1:
+            shards = min(shards, max(len(train), 1))
+            for k in range(shards):
+                group = train_parts[len(train) * k // shards:len(train) * (k + 1) // shards]
+                _concat(group, Path(output) / ('converted_train.%05d.jsonl' % k))
+        else:
+            _concat(train_parts, Path(output) / 'converted_train.jsonl')
+
+        _concat([test_part], Path(output) / 'converted_test.jsonl')
+    finally:
+        shutil.rmtree(tmp)
+
+    return sum(counts[:-1]), counts[-1]
@@ -5,20 +5,20 @@ import multiprocessing
 
 from tqdm.auto import tqdm
 
-from ..lexer import Lexer
+from ..tokenizer import tokenize
 
 
 def varcorpus_tokenize(raw):
     tokens = []
     variables = {}
 
-    for tok in Lexer(raw).get_tokens():
-        if tok[1].startswith('@@') and tok[1].endswith('@@'):
-            var, name = tok[1][2:-2].split('@@')
+    for tok in tokenize(raw):
+        if tok.startswith('@@') and tok.endswith('@@'):
+            var, name = tok[2:-2].split('@@')
             variables[var] = name
             tokens.append('@@' + var + '@@')
         else:
-            tokens.append(tok[1])
+            tokens.append(tok)
 
     return tokens, variables
 
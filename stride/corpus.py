@@ -1,123 +1,238 @@
 
+import glob
 import json
+import os
 from typing import List, Tuple, Set, Dict, Generator
-import re
-
-from .ngram import ngram_hash
-
-GHIDRA_STACK = re.compile('[a-z]*Stack_[0-9]+')
-
-GHIDRA_VAR = re.compile('[a-z]*Var[0-9]+')
-
-GHIDRA_ADDR_STRING = re.compile('s_[a-zA-Z0-9_]+[a-fA-F0-9]{8}')
-GHIDRA_ADDR_PTR = re.compile('PTR_[a-zA-Z0-9_]+[a-fA-F0-9]{8}')
-
-HEXNUM = re.compile('0x[0-9a-fA-F]+')
-DECNUM = re.compile('[0-9]+')
-
-PREFIXES = [
-    # IDA
-    'sub_', 'loc_', 'unk_', 'off_', 'asc_', 'stru_', 'funcs_',
-    'byte_', 'word_', 'dword_', 'qword_', 'xmmword_', 'ymmword_',
-    'LABEL_',
-
-    # Ghidra
-    'FUN_', 'thunk_FUN_', 
-    'LAB_', 'joined_r0x', # goto labels
-    'DAT_', '_DAT_', 'code_r0x', 'uRam', # data and code labels 
-    'switchD_', 'switchdataD_', 'caseD_', # switch labels
-]
-
-FULL_STRIP = '''
-?
-Number
-String
-L
-
-__int8
-__int16
-__int32
-__int64
-LODWORD
-const
-_BYTE
-_WORD
-_DWORD
-_QWORD
-char
-float
-double
-__fastcall
-unsigned
-void
-
-break
-if
-else
-while
-int
-void
-goto
-
-[
-]
-(
+
+import numpy as np
+
+from .ngram import ngram_hash, NGramHasher
+from .normalize import (
+    GHIDRA_STACK, GHIDRA_VAR, GHIDRA_ADDR_STRING, GHIDRA_ADDR_PTR, HEXNUM, DECNUM,
+    PREFIXES, FULL_STRIP, normalize_tokens,
 )
-{
-}
-+
--
-,
-;
-*
-*=
-<
->
-=
-<=
->=
-==
-!=
-++
---
-+=
--=
-<<
->>
-<<=
->>=
-!
-|
-||
-|=
-&
-&&
-&=
-/
-/=
-^
-^=
-%
-%=
-'''
-
-FULL_STRIP = [x for x in FULL_STRIP.split() if x != '']
+
 
 class Corpus(object):
+    '''
+    A corpus of functions, either a STRIDE format .jsonl file or a directory
+    written by stride.tools.compile_corpus. A glob pattern (e.g. for the
+    sharded converter output) reads the matching .jsonl files in sorted order.
+    '''
+    def __init__(self, path, full_strip=False):
+        self.path = path
+        self.full_strip = full_strip
+        self.compiled = CompiledCorpus(path, full_strip=full_strip) if os.path.isdir(path) else None
+        self.files = sorted(glob.glob(path)) if glob.has_magic(path) else [path]
+
+    def __iter__(self):
+        if self.compiled is not None:
+            yield from self.compiled
+            return
+
+        for path in self.files:
+            with open(path, 'r') as f:
+                for line in f:
+                    yield Entry(json.loads(line), full_strip=self.full_strip)
+
+    def __len__(self):
+        if self.compiled is None:
+            raise TypeError('Random access needs a compiled corpus (see stride.tools.compile_corpus)')
+        return len(self.compiled)
+
+    def split(self, chunk: int = 64) -> List['CorpusSlice']:
+        '''
+        Splits the corpus into slices of up to chunk functions. A slice is
+        just a byte range of a .jsonl file (or an index range of a compiled
+        corpus), so it is cheap to send to a worker process, which then reads
+        and parses the functions itself. Iterating the slices in order yields
+        the same functions as iterating the corpus.
+        '''
+        if self.compiled is not None:
+            return [
+                CorpusSlice(self.path, i, min(i + chunk, len(self.compiled)), self.full_strip, compiled=True)
+                for i in range(0, len(self.compiled), chunk)
+            ]
+
+        slices = []
+        for path in self.files:
+            starts, size = line_offsets(path)
+            for i in range(0, len(starts), chunk):
+                end = starts[i + chunk] if i + chunk < len(starts) else size
+                slices.append(CorpusSlice(path, int(starts[i]), int(end), self.full_strip))
+        return slices
+
+    def __getitem__(self, index: int) -> 'Entry':
+        if self.compiled is None:
+            raise TypeError('Random access needs a compiled corpus (see stride.tools.compile_corpus)')
+        return self.compiled[index]
+
+
+def line_offsets(path: str, block: int = 1 << 24) -> Tuple[np.ndarray, int]:
+    '''Returns the byte offset of every line in a file and the file size.'''
+    starts = [np.zeros(1, dtype=np.int64)]
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            buf = f.read(block)
+            if len(buf) == 0:
+                break
+            starts.append(np.flatnonzero(np.frombuffer(buf, dtype=np.uint8) == ord('\n')) + (size + 1))
+            size += len(buf)
+
+    starts = np.concatenate(starts)
+
+    # Drop the empty "line" after a trailing newline
+    if starts[-1] >= size:
+        starts = starts[:-1]
+
+    return starts, size
+
+
+class CorpusSlice(object):
+    '''
+    A range of functions of a corpus: bytes [start, end) of a .jsonl file, or
+    functions [start, end) of a compiled corpus. See Corpus.split.
+    '''
+    def __init__(self, path: str, start: int, end: int, full_strip: bool = False, compiled: bool = False):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.full_strip = full_strip
+        self.compiled = compiled
+
+    def __repr__(self):
+        return f'CorpusSlice({self.path}, {self.start}, {self.end})'
+
+    def __iter__(self):
+        if self.compiled:
+            corpus = _open_compiled(self.path, self.full_strip)
+            for i in range(self.start, self.end):
+                yield corpus[i]
+            return
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.start)
+            data = f.read(self.end - self.start)
+
+        for line in data.splitlines():
+            yield Entry(json.loads(line), full_strip=self.full_strip)
+
+
+# Compiled corpora opened by this process, so that the string table is only
+# loaded once per worker rather than once per slice.
+_compiled = {}
+
+
+def _open_compiled(path: str, full_strip: bool) -> 'CompiledCorpus':
+    key = (path, full_strip)
+    if key not in _compiled:
+        _compiled[key] = CompiledCorpus(path, full_strip=full_strip)
+    return _compiled[key]
+
+
+class CompiledCorpus(object):
+    '''
+    Reads a pre-tokenized binary corpus.
+
+    Tokens and normalized tokens are stored as interned string IDs in flat
+    arrays indexed by per-function offsets, together with the variable
+    positions and interned labels, so functions are decoded straight from
+    memory-mapped arrays without any JSON parsing. See
+    stride.tools.compile_corpus for the layout.
+    '''
+    VERSION = 1
+
     def __init__(self, path, full_strip=False):
         self.path = path
         self.full_strip = full_strip
 
+        with open(os.path.join(path, 'index.json'), 'r') as f:
+            index = json.load(f)
+
+        if index['version'] != CompiledCorpus.VERSION:
+            raise ValueError('Unsupported compiled corpus version: %d' % index['version'])
+
+        self.count = index['count']
+        self.kinds = index['kinds']
+        self.strings = index['strings']
+
+        if full_strip:
+            keep = set(FULL_STRIP)
+            self.norm_strings = [x if x in keep else '?' for x in self.strings]
+        else:
+            self.norm_strings = self.strings
+
+        self.tokens = self._array('tokens', np.uint32)
+        self.norm = self._array('norm', np.uint32)
+        self.tok_offsets = self._array('tok_offsets', np.int64)
+        self.var_pos = self._array('var_pos', np.uint32)
+        self.var_offsets = self._array('var_offsets', np.int64)
+        self.meta = self._array('meta', np.uint8)
+        self.meta_offsets = self._array('meta_offsets', np.int64)
+
+        self.labels = {
+            kind: (
+                self._array('labels.%s.var' % kind, np.uint32),
+                self._array('labels.%s.label' % kind, np.uint32),
+                self._array('labels.%s.human' % kind, np.uint8),
+                self._array('labels.%s.offsets' % kind, np.int64),
+            )
+            for kind in self.kinds
+        }
+
+    def _array(self, name, dtype):
+        fpath = os.path.join(self.path, name + '.bin')
+        if os.path.getsize(fpath) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(fpath, dtype=dtype, mode='r')
+
+    def __len__(self):
+        return self.count
+
     def __iter__(self):
-        with open(self.path, 'r') as f:
-            for line in f:
-                yield Entry(json.loads(line), full_strip=self.full_strip)
+        for i in range(self.count):
+            yield self[i]
+
+    def __getitem__(self, index: int) -> 'Entry':
+        if index < 0:
+            index += self.count
+        if index < 0 or index >= self.count:
+            raise IndexError(index)
+
+        strings = self.strings
+
+        lo, hi = self.tok_offsets[index], self.tok_offsets[index+1]
+        raw = {
+            'tokens': [strings[x] for x in self.tokens[lo:hi].tolist()],
+            'labels': {},
+        }
+
+        for kind, (var, label, human, offsets) in self.labels.items():
+            a, b = offsets[index], offsets[index+1]
+            raw['labels'][kind] = {
+                strings[v]: {'label': strings[l], 'human': bool(h)}
+                for v, l, h in zip(var[a:b].tolist(), label[a:b].tolist(), human[a:b].tolist())
+            }
+
+        a, b = self.meta_offsets[index], self.meta_offsets[index+1]
+        if b > a:
+            raw['meta'] = json.loads(self.meta[a:b].tobytes())
+
+        entry = Entry(raw, full_strip=self.full_strip)
+        entry._stripped_tokens = [self.norm_strings[x] for x in self.norm[lo:hi].tolist()]
+
+        a, b = self.var_offsets[index], self.var_offsets[index+1]
+        entry._var_positions = self.var_pos[a:b].tolist()
+
+        return entry
 
 
 class Entry(object):
     def __init__(self, raw, full_strip=False):
         self.raw = raw
         self._stripped_tokens = None
+        self._var_positions = None
         self.full_strip = full_strip
 
     @property
@@ -129,52 +244,15 @@ class Entry(object):
         if self._stripped_tokens is not None:
             return self._stripped_tokens
 
-        out = []
-        for tok in self.tokens:
-            norm = tok
-            for prefix in PREFIXES:
-                if tok.startswith(prefix):
-                    norm = prefix + 'XXX'
-                    break
-            
-            if tok.startswith('"') and tok.endswith('"'):
-                norm = '<STRING>'
-
-            if GHIDRA_STACK.fullmatch(tok):
-                norm = '<ghidra_stack>'
-
-            if GHIDRA_VAR.fullmatch(tok):
-                norm = '<ghidra_var>'
-
-            if GHIDRA_ADDR_STRING.fullmatch(tok):
-                norm = tok[:-8]
-
-            if GHIDRA_ADDR_PTR.fullmatch(tok):
-                norm = tok[:-8]
-
-            if HEXNUM.fullmatch(tok):
-                val = int(tok, 16)
-                if val >= 0x100:
-                    hex_digits = len(hex(val)[2:])
-                    norm = '<NUM_%d>' % hex_digits
-                else:
-                    norm = hex(val)
-
-            if DECNUM.fullmatch(tok):
-                val = int(tok)
-                if val >= 0x100:
-                    hex_digits = len(hex(val)[2:])
-                    norm = '<NUM_%d>' % hex_digits
-                else:
-                    norm = hex(val)
-
-            out.append(norm)
-
-        if self.full_strip:
-            out = [x if x in FULL_STRIP else '?' for x in out]
-
-        self._stripped_tokens = out
-        return out
+        self._stripped_tokens = normalize_tokens(self.tokens, full_strip=self.full_strip)
+        return self._stripped_tokens
+
+    @property
+    def var_positions(self) -> List[int]:
+        '''Indices of all variable tokens.'''
+        if self._var_positions is None:
+            self._var_positions = [i for i, tok in enumerate(self.tokens) if tok.startswith('@@') and tok.endswith('@@')]
+        return self._var_positions
 
     @property
     def meta(self) -> Dict:
@@ -183,7 +261,11 @@ class Entry(object):
         return {}
 
     def labels(self, label):
-        return Labels(self.raw['labels'][label])
+        labels = self.raw['labels']
+        if label not in labels:
+            # e.g. a compiled corpus built without this label kind
+            raise ValueError('Function has no %r labels (has: %s)' % (label, ', '.join(sorted(labels)) or 'none'))
+        return Labels(labels[label])
     
     def all_vars(self) -> Set[str]:
         return set(x[2:-2] for x in self.tokens if x.startswith('@@') and x.endswith('@@'))
@@ -211,29 +293,44 @@ class Entry(object):
     def iter_ngrams(self, size: int, flanking: bool = False) -> Generator[Tuple[bytes, List[str], any, str], None, None]:
         '''Iterates over all N-grams of a given size in the function. Returns a tuple of (hash, span, idx, variable).'''
         padded = ['??'] * size + self.stripped_tokens + ['??'] * size
-        for i in range(len(self.tokens)):
-            if self.tokens[i].startswith('@@') and self.tokens[i].endswith('@@'):
-                var = self.tokens[i][2:-2]
-
-                if not flanking:
-                    # centered ngrams
-                    span = padded[i:i+size*2+1]
-                    h = ngram_hash(span)
-                    yield (h, span, i, var)
-                else:
-                    # flanking ngrams
-                    # . . [ . . . {C] . . . } . .
-
-                    # center is at size + i
-
-                    left_span = padded[i:i+size]
-                    right_span = padded[i+size+1:i+size*2+1]
-
-                    left_h = ngram_hash(left_span, b'left')
-                    right_h = ngram_hash(right_span, b'right')
-
-                    yield (left_h, left_span, (i, False), var)
-                    yield (right_h, right_span, (i, True), var)
+        for i in self.var_positions:
+            var = self.tokens[i][2:-2]
+
+            if not flanking:
+                # centered ngrams
+                span = padded[i:i+size*2+1]
+                h = ngram_hash(span)
+                yield (h, span, i, var)
+            else:
+                # flanking ngrams
+                # . . [ . . . {C] . . . } . .
+
+                # center is at size + i
+
+                left_span = padded[i:i+size]
+                right_span = padded[i+size+1:i+size*2+1]
+
+                left_h = ngram_hash(left_span, b'left')
+                right_h = ngram_hash(right_span, b'right')
+
+                yield (left_h, left_span, (i, False), var)
+                yield (right_h, right_span, (i, True), var)
+
+    def iter_ngram_hashes(self, sizes: List[int], flanking: bool = False) -> Generator[Tuple[any, str, Dict[int, bytes]], None, None]:
+        '''
+        Hashes the N-grams of several sizes at each variable position in one pass.
+        Returns a tuple of (idx, variable, {size: hash}) in the same order as
+        iter_ngrams, with hashes identical to iter_ngrams for each size.
+        '''
+        hasher = NGramHasher(self.stripped_tokens)
+        for i in self.var_positions:
+            var = self.tokens[i][2:-2]
+
+            if not flanking:
+                yield (i, var, hasher.centered(i, sizes))
+            else:
+                yield ((i, False), var, hasher.left(i, sizes))
+                yield ((i, True), var, hasher.right(i, sizes))
 
 
 class Labels(object):
@@ -1,55 +1,449 @@
-
 from typing import List, Tuple
 
 import h5py
+import numpy as np
+
+from .bloom import BloomFilter
+from .index import BucketIndex, _key64
+
+
+def _mmap_dataset(fpath, dset):
+    '''Maps a contiguous, uncompressed HDF5 dataset read-only, falling back to reading it into memory.'''
+    offset = dset.id.get_offset()
+    if offset is None or dset.chunks is not None or dset.size == 0:
+        return dset[()]
+
+    return np.memmap(fpath, dtype=dset.dtype, mode='r', offset=offset, shape=dset.shape)
+
+
+def _narrow(arr):
+    '''Casts non-negative integers to the narrowest unsigned type that holds them.'''
+    arr = np.asarray(arr)
+    top = int(arr.max()) if arr.size > 0 else 0
+    for dtype in [np.uint8, np.uint16, np.uint32]:
+        if top <= np.iinfo(dtype).max:
+            return arr.astype(dtype)
+    return arr.astype(np.uint64)
+
+
+def _hashes(dbs) -> list:
+    '''The hsh arrays of dbs, all as 64-bit keys if any of them only stores 64-bit keys.'''
+    if any(db.hsh.dtype == np.uint64 for db in dbs):
+        return [db.hsh if db.hsh.dtype == np.uint64 else _key64(db.hsh) for db in dbs]
+    return [db.hsh for db in dbs]
 
 
 class NGramDBMulti(object):
-    def __init__(self, size: List[int], hsh, total, typ, counts):
+    '''
+    Sorted hash -> top-k targets table.
+
+    A database may hold a single N-gram size, or several sizes in one index
+    (see merge). The hashed token spans of different sizes contain a different
+    number of separators, so hashes never collide across sizes and a single
+    sorted index can serve every size at once. For multi-size databases
+    entry_size records which size each entry came from.
+
+    An optional Bloom filter (see build_filter) is checked before the
+    sorted-array search so that most misses never touch hsh. Saved databases
+    also store a BucketIndex over the leading hash bits, which narrows each
+    search down to a handful of entries.
+
+    Databases saved with compact=True store hsh as 64-bit keys (the first 8
+    bytes of each hash) and the targets sparsely, see save.
+    '''
+    COMPACT_VERSION = 1
+
+    def __init__(self, size: List[int], hsh, total, typ, counts, entry_size=None, filter: BloomFilter = None, index: BucketIndex = None):
         self.size = size
         self.hsh = hsh
         self.total = total
         self.typ = typ
         self.counts = counts
+        self.entry_size = entry_size
+        self.filter = filter
+        self.index = index
 
     def __repr__(self):
         return f'NGramDBMulti(size={self.size}, count={len(self.hsh)})'
 
-    def save(self, fpath):
+    @property
+    def sizes(self) -> List[int]:
+        '''N-gram sizes served by this database, largest first.'''
+        return sorted((int(x) for x in np.atleast_1d(self.size)), reverse=True)
+
+    @property
+    def topk(self) -> int:
+        return self.typ.shape[1]
+
+    def save(self, fpath, compact: bool = False):
+        if compact:
+            self._save_compact(fpath)
+            return
+
         with h5py.File(fpath, 'w') as f:
             f['size'] = self.size
             f['hsh'] = self.hsh
+            self._save_index(f)
             f['total'] = self.total
             f['typ'] = self.typ
             f['counts'] = self.counts
+            if self.entry_size is not None:
+                f['entry_size'] = self.entry_size
+            if self.filter is not None:
+                f['filter'] = self.filter.words
+                f['filter_k'] = self.filter.k
+
+    def _save_index(self, f):
+        if self.index is None:
+            self.build_index()
+        f['index_offsets'] = self.index.offsets
+        f['index_bits'] = self.index.bits
+
+    def _save_compact(self, fpath):
+        '''
+        Compact layout (format attribute "compact"):
+            key:           uint64, first 8 bytes of each hash (big-endian)
+            total:         narrowest unsigned type that fits
+            ntargets:      number of targets per entry, narrowest type
+            target_typ,    targets of all entries back to back (CSR with
+            target_count:  ntargets as row lengths), narrowest types
+            entry_size, filter, filter_k: as in the full format
+        '''
+        key = self.hsh if self.hsh.dtype == np.uint64 else _key64(self.hsh)
+        if np.any(key[1:] == key[:-1]):
+            raise ValueError('Hashes collide in their first 8 bytes, use the full format')
+
+        typ = np.asarray(self.typ)
+        counts = np.asarray(self.counts)
+        valid = counts > 0
+
+        with h5py.File(fpath, 'w') as f:
+            f.attrs['format'] = 'compact'
+            f.attrs['version'] = NGramDBMulti.COMPACT_VERSION
+            f.attrs['topk'] = self.topk
+            f['size'] = self.size
+            f['key'] = key
+            self._save_index(f)
+            f['total'] = _narrow(self.total)
+            f['ntargets'] = _narrow(valid.sum(axis=1))
+            f['target_typ'] = _narrow(typ[valid])
+            f['target_count'] = _narrow(counts[valid])
+            if self.entry_size is not None:
+                f['entry_size'] = _narrow(self.entry_size)
+            if self.filter is not None:
+                f['filter'] = self.filter.words
+                f['filter_k'] = self.filter.k
 
     @staticmethod
-    def load(fpath) -> 'NGramDBMulti':
+    def load(fpath, mmap: bool = False) -> 'NGramDBMulti':
+        '''
+        Loads a database from disk.
+
+        With mmap=True the arrays are memory-mapped straight out of the HDF5
+        file instead of being read into memory, so loading is nearly free and
+        every process that maps the same file shares one page-cache copy.
+        '''
+        read = (lambda dset: _mmap_dataset(fpath, dset)) if mmap else (lambda dset: dset[()])
+
         with h5py.File(fpath, 'r') as f:
+            if f.attrs.get('format') == 'compact':
+                return NGramDBMulti._load_compact(f, read)
+
             size = f['size'][()]
-            hsh = f['hsh'][()]
-            total = f['total'][()]
-            typ = f['typ'][()]
-            counts = f['counts'][()]
+            hsh = read(f['hsh'])
+            total = read(f['total'])
+            typ = read(f['typ'])
+            counts = read(f['counts'])
+            entry_size = read(f['entry_size']) if 'entry_size' in f else None
+            filter = BloomFilter(read(f['filter']), f['filter_k'][()]) if 'filter' in f else None
+            index = BucketIndex(read(f['index_offsets']), f['index_bits'][()]) if 'index_offsets' in f else None
+
+        return NGramDBMulti(size, hsh, total, typ, counts, entry_size, filter, index)
+
+    @staticmethod
+    def _load_compact(f, read) -> 'NGramDBMulti':
+        '''Decodes the compact layout. Only the keys and filter can be memory-mapped.'''
+        version = int(f.attrs['version'])
+        if version != NGramDBMulti.COMPACT_VERSION:
+            raise ValueError('Unsupported compact database version: %d' % version)
+
+        ntargets = f['ntargets'][()]
+        valid = np.arange(int(f.attrs['topk'])) < ntargets[:, None]
+
+        typ = np.zeros(valid.shape, dtype=np.uint32)
+        counts = np.zeros(valid.shape, dtype=np.uint32)
+        typ[valid] = f['target_typ'][()]
+        counts[valid] = f['target_count'][()]
+
+        return NGramDBMulti(
+            f['size'][()],
+            read(f['key']),
+            f['total'][()].astype(np.uint32),
+            typ,
+            counts,
+            f['entry_size'][()].astype(np.uint16) if 'entry_size' in f else None,
+            BloomFilter(read(f['filter']), f['filter_k'][()]) if 'filter' in f else None,
+            BucketIndex(read(f['index_offsets']), f['index_bits'][()]) if 'index_offsets' in f else None,
+        )
+
+    def build_index(self, bits: int = None):
+        '''Builds the bucket index (saved databases always have one).'''
+        self.index = BucketIndex.build(self.hsh, bits)
+
+    def build_filter(self, bits_per_key: float = 10):
+        '''Builds a Bloom filter over the hashes (about 1% false positives at 10 bits per key).'''
+        if self.hsh.dtype == np.uint64:
+            raise ValueError('Bloom filters need the full hashes, build the filter before converting to the compact format')
+        self.filter = BloomFilter.build(self.hsh, bits_per_key)
+
+    @staticmethod
+    def merge(dbs: List['NGramDBMulti']) -> 'NGramDBMulti':
+        '''Merges databases of different sizes into a single multi-size database.'''
+        topk = max(db.typ.shape[1] for db in dbs)
+
+        def pad(arr):
+            return np.pad(arr, ((0, 0), (0, topk - arr.shape[1])))
 
-        return NGramDBMulti(size, hsh, total, typ, counts)
+        sizes = [size for db in dbs for size in db.sizes]
+        if len(set(sizes)) != len(sizes):
+            raise ValueError('Duplicate N-gram sizes: %s' % sizes)
+
+        hsh = np.concatenate(_hashes(dbs))
+        order = np.argsort(hsh, kind='stable')
+        hsh = hsh[order]
+
+        if np.any(hsh[1:] == hsh[:-1]):
+            raise ValueError('Hash collision between N-gram sizes')
+
+        entry_size = np.concatenate([
+            db.entry_size if db.entry_size is not None else np.full(len(db.hsh), db.sizes[0], dtype=np.uint16)
+            for db in dbs
+        ])
+
+        return NGramDBMulti(
+            np.array(sorted(sizes, reverse=True)),
+            hsh,
+            np.concatenate([db.total for db in dbs])[order],
+            np.concatenate([pad(db.typ) for db in dbs])[order],
+            np.concatenate([pad(db.counts) for db in dbs])[order],
+            entry_size[order].astype(np.uint16),
+        )
+
+    def split(self, size: int) -> 'NGramDBMulti':
+        '''Extracts the entries of a single N-gram size.'''
+        if self.entry_size is None:
+            if size not in self.sizes:
+                raise KeyError(size)
+            return self
+
+        mask = self.entry_size == size
+        return NGramDBMulti(size, self.hsh[mask], self.total[mask], self.typ[mask], self.counts[mask])
 
     def lookup(self, key) -> Tuple[int, List[Tuple[int, int]]]:
-        a = 0
-        b = len(self.hsh)
-
-        while a < b:
-            m = (a + b) // 2
-
-            q = self.hsh[m]
-            if q == key:
-                total = self.total[m]
-                typ = self.typ[m]
-                counts = self.counts[m]
-                return total, list(zip(typ, counts))
-            elif q < key:
-                a = m+1
-            elif q > key:
-                b = m
-
-        return None
+        if self.index is None or len(self.hsh) == 0:
+            hit, total, typ, counts = self.lookup_many([key])
+            if not hit[0]:
+                return None
+
+            return total[0], list(zip(typ[0], counts[0]))
+
+        if self.hsh.dtype == np.uint64 and not isinstance(key, (int, np.integer)):
+            key = _key64([key])[0]
+        key = np.asarray(key, dtype=self.hsh.dtype)
+
+        i = self.index.search(self.hsh, key)
+        if i == len(self.hsh) or self.hsh[i] != key:
+            return None
+
+        return self.total[i], list(zip(self.typ[i], self.counts[i]))
+
+    def lookup_many(self, keys):
+        '''
+        Looks up a batch of hashes at once.
+
+        Returns a tuple of (hit, total, typ, counts) aligned with keys. Rows
+        for keys that are not in the database are zero.
+
+        Keys are 12-byte hashes, or 64-bit keys for compact databases.
+        '''
+        keys = np.asarray(keys)
+        if keys.dtype != np.uint64:
+            keys = keys.astype('|S12')
+
+        hsh = self.hsh
+        query = keys
+        if hsh.dtype == np.uint64 and keys.dtype != np.uint64:
+            query = _key64(keys)
+        elif hsh.dtype != np.uint64 and keys.dtype == np.uint64:
+            # Slow path, only used when compacting full deltas into a compact base
+            hsh = _key64(hsh)
+
+        # Only search for keys which may be present
+        if self.filter is not None and keys.dtype != np.uint64:
+            cand = np.flatnonzero(self.filter.contains_many(keys))
+        else:
+            cand = np.arange(len(keys))
+
+        query = query[cand]
+        if self.index is not None and hsh is self.hsh:
+            idx = self.index.search_many(hsh, query)
+        else:
+            idx = np.searchsorted(hsh, query)
+        idx[idx == len(hsh)] = 0
+
+        found = (hsh[idx] == query) if len(hsh) > 0 else np.zeros(len(cand), dtype=bool)
+
+        hit = np.zeros(len(keys), dtype=bool)
+        hit[cand[found]] = True
+        idx = idx[found]
+
+        total = np.zeros(len(keys), dtype=self.total.dtype)
+        typ = np.zeros((len(keys),) + self.typ.shape[1:], dtype=self.typ.dtype)
+        counts = np.zeros((len(keys),) + self.counts.shape[1:], dtype=self.counts.dtype)
+
+        total[hit] = self.total[idx]
+        typ[hit] = self.typ[idx]
+        counts[hit] = self.counts[idx]
+
+        return hit, total, typ, counts
+
+
+def _combine_rows(typ, counts, topk: int):
+    '''
+    Sums the counts of equal targets within each row of (typ, counts) and
+    keeps the topk targets per row, ranked by count and then target id.
+    '''
+    n = typ.shape[0]
+    row = np.repeat(np.arange(n), typ.shape[1])
+    valid = counts.ravel() > 0
+
+    row = row[valid]
+    label = typ.ravel()[valid].astype(np.int64)
+    count = counts.ravel()[valid].astype(np.int64)
+
+    out_typ = np.zeros((n, topk), dtype=np.uint32)
+    out_counts = np.zeros((n, topk), dtype=np.uint32)
+    if len(row) == 0:
+        return out_typ, out_counts
+
+    # Sum duplicate (row, label) pairs
+    width = label.max() + 1
+    pair, inverse = np.unique(row * width + label, return_inverse=True)
+    count = np.bincount(inverse.ravel(), weights=count).astype(np.int64)
+    row, label = pair // width, pair % width
+
+    order = np.lexsort((label, -count, row))
+    row, label, count = row[order], label[order], count[order]
+
+    slot = np.arange(len(row)) - np.searchsorted(row, row, side='left')
+    keep = slot < topk
+
+    out_typ[row[keep], slot[keep]] = label[keep]
+    out_counts[row[keep], slot[keep]] = count[keep]
+    return out_typ, out_counts
+
+
+class NGramDBLayered(object):
+    '''
+    A base database with delta layers built from newly labelled functions.
+
+    Lookups query every layer and add up the totals and per-target counts of
+    all layers that hit, then re-rank the targets to the base top-k. Rows
+    which only hit the base are returned unchanged. Targets outside a layer's
+    stored top-k are not known, so re-ranking only sees the stored targets.
+
+    compact() folds the deltas into a single database.
+    '''
+    def __init__(self, base: NGramDBMulti, deltas: List[NGramDBMulti]):
+        for delta in deltas:
+            if delta.sizes != base.sizes:
+                raise ValueError('Delta sizes %s do not match base sizes %s' % (delta.sizes, base.sizes))
+
+        self.base = base
+        self.deltas = deltas
+
+    def __repr__(self):
+        return f'NGramDBLayered(base={self.base}, deltas={len(self.deltas)})'
+
+    @property
+    def layers(self) -> List[NGramDBMulti]:
+        return [self.base] + self.deltas
+
+    @property
+    def size(self):
+        return self.base.size
+
+    @property
+    def sizes(self) -> List[int]:
+        return self.base.sizes
+
+    @property
+    def topk(self) -> int:
+        return self.base.topk
+
+    def lookup(self, key) -> Tuple[int, List[Tuple[int, int]]]:
+        hit, total, typ, counts = self.lookup_many([key])
+        if not hit[0]:
+            return None
+
+        return total[0], list(zip(typ[0], counts[0]))
+
+    def lookup_many(self, keys):
+        hit, total, typ, counts = self.base.lookup_many(keys)
+        total = total.astype(np.uint64)
+
+        delta_hit = np.zeros(len(hit), dtype=bool)
+        all_typ = [typ]
+        all_counts = [counts]
+
+        for delta in self.deltas:
+            d_hit, d_total, d_typ, d_counts = delta.lookup_many(keys)
+            delta_hit |= d_hit
+            total += d_total
+            all_typ.append(d_typ)
+            all_counts.append(d_counts)
+
+        rows = np.flatnonzero(delta_hit)
+        if len(rows) > 0:
+            typ = typ.copy()
+            counts = counts.copy()
+            typ[rows], counts[rows] = _combine_rows(
+                np.concatenate([t[rows] for t in all_typ], axis=1),
+                np.concatenate([c[rows] for c in all_counts], axis=1),
+                self.topk,
+            )
+
+        return hit | delta_hit, total.astype(np.uint32), typ, counts
+
+    def compact(self) -> NGramDBMulti:
+        '''Folds the delta layers into a single database.'''
+        hsh = np.concatenate(_hashes(self.layers))
+        hsh, first = np.unique(hsh, return_index=True)
+
+        _hit, total, typ, counts = self.lookup_many(hsh)
+
+        entry_size = None
+        if self.base.entry_size is not None:
+            entry_size = np.concatenate([db.entry_size for db in self.layers])[first]
+
+        db = NGramDBMulti(self.base.size, hsh, total, typ, counts, entry_size)
+        if self.base.filter is not None and hsh.dtype != np.uint64:
+            db.build_filter(self.base.filter.nbytes * 8 / max(len(self.base.hsh), 1))
+
+        return db
+
+
+def with_deltas(dbs: List[NGramDBMulti], deltas: List[NGramDBMulti]) -> List[NGramDBMulti]:
+    '''Layers each delta database onto the base database with the same sizes.'''
+    out = []
+    used = set()
+    for db in dbs:
+        mine = [i for i, delta in enumerate(deltas) if delta.sizes == db.sizes]
+        used.update(mine)
+        out.append(NGramDBLayered(db, [deltas[i] for i in mine]) if len(mine) > 0 else db)
+
+    if len(used) != len(deltas):
+        unmatched = [deltas[i].sizes for i in range(len(deltas)) if i not in used]
+        raise ValueError('No base database for deltas with sizes %s' % unmatched)
+
+    return out
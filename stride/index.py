@@ -0,0 +1,80 @@
+import numpy as np
+
+
+def _key64(keys):
+    '''First 8 bytes of each 12-byte hash as a big-endian integer, which keeps the sort order.'''
+    raw = np.ascontiguousarray(np.asarray(keys, dtype='|S12')).view(np.uint8).reshape(-1, 12)
+    return np.ascontiguousarray(raw[:, :8]).view('>u8').ravel().astype(np.uint64)
+
+
+class BucketIndex(object):
+    '''
+    Direct-addressed table over the leading bits of the sorted hashes.
+
+    Hashes are uniformly distributed, so the entries starting with each
+    bits-bit prefix form a short contiguous run of hsh and
+    offsets[p]:offsets[p+1] is the run for prefix p. A lookup jumps straight
+    to its run and only searches within it.
+    '''
+    def __init__(self, offsets, bits: int):
+        self.offsets = offsets
+        self.bits = int(bits)
+        self.shift = np.uint64(64 - self.bits)
+
+        # Longest run, which bounds the number of search steps
+        self.depth = int(np.diff(offsets).max()).bit_length() if len(offsets) > 1 else 0
+
+    def __repr__(self):
+        return f'BucketIndex(bits={self.bits}, depth={self.depth})'
+
+    @staticmethod
+    def default_bits(n: int) -> int:
+        '''About two to four entries per bucket, between 16 and 24 bits once the database is large enough.'''
+        return int(min(24, max(1, int(n).bit_length() - 2)))
+
+    @staticmethod
+    def build(hsh, bits: int = None) -> 'BucketIndex':
+        hsh = np.asarray(hsh)
+        if bits is None:
+            bits = BucketIndex.default_bits(len(hsh))
+
+        key = hsh if hsh.dtype == np.uint64 else _key64(hsh)
+        counts = np.bincount((key >> np.uint64(64 - bits)).astype(np.int64), minlength=1 << bits)
+
+        offsets = np.zeros((1 << bits) + 1, dtype=np.uint32 if len(hsh) < (1 << 32) else np.uint64)
+        np.cumsum(counts, out=offsets[1:])
+        return BucketIndex(offsets, bits)
+
+    def _prefix(self, keys):
+        key = keys if keys.dtype == np.uint64 else _key64(keys)
+        return (key >> self.shift).astype(np.int64)
+
+    def search_many(self, hsh, keys):
+        '''
+        Same as np.searchsorted(hsh, keys) for sorted hsh. All keys are binary
+        searched in lockstep within their own bucket.
+        '''
+        p = self._prefix(keys)
+        lo = self.offsets[p].astype(np.int64)
+        hi = self.offsets[p + 1].astype(np.int64)
+
+        last = max(len(hsh) - 1, 0)
+        for _ in range(self.depth):
+            active = lo < hi
+            mid = (lo + hi) >> 1
+            less = hsh[np.minimum(mid, last)] < keys
+            lo = np.where(active & less, mid + 1, lo)
+            hi = np.where(active & ~less, mid, hi)
+
+        return lo
+
+    def search(self, hsh, key) -> int:
+        '''Scalar version of search_many.'''
+        if hsh.dtype == np.uint64:
+            p = int(key) >> int(self.shift)
+        else:
+            p = int.from_bytes(bytes(key)[:8].ljust(8, b'\x00'), 'big') >> int(self.shift)
+
+        lo = int(self.offsets[p])
+        hi = int(self.offsets[p + 1])
+        return lo + int(np.searchsorted(hsh[lo:hi], key))
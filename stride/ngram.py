@@ -1,13 +1,15 @@
 
 import hashlib
 import multiprocessing
-from typing import List
+import tempfile
+from typing import Dict, List, Tuple
 
 from tqdm.auto import tqdm
 import numpy as np
 
 from .db import NGramDBMulti
-from .vocab import Vocab
+from .spill import RECORD_COST, SpillBuilder
+from .vocab import Vocab, count_labels, merge_counts
 
 
 def ngram_hash(tokens, discriminator: bytes = b''):
@@ -31,6 +33,89 @@ def ngram_hash(tokens, discriminator: bytes = b''):
     return hashlib.sha256(raw).digest()[:12]
 
 
+class NGramHasher(object):
+    '''
+    Computes ngram_hash for several N-gram sizes around a position at once.
+
+    Tokens are encoded once per function. Right spans grow outward from the
+    variable, so their SHA-256 state and variable renaming are extended one
+    token at a time and snapshotted at each requested size. Left and centered
+    spans change their leftmost token as they grow, which changes the
+    renaming, so they are joined from the pre-encoded tokens for each size.
+
+    All hashes are bit-identical to ngram_hash over the padded span.
+    '''
+    PAD = b'??'
+
+    def __init__(self, tokens: List[str]):
+        # Encoded token, or None for variables (which are renamed per span)
+        self.enc = []
+        self.var = []
+        for tok in tokens:
+            if tok.startswith('@@') and tok.endswith('@@'):
+                self.enc.append(None)
+                self.var.append(tok[2:-2])
+            else:
+                self.enc.append(tok.encode('utf-8'))
+                self.var.append(None)
+
+        self.var_names = []
+
+    def _var_name(self, k: int) -> bytes:
+        while len(self.var_names) <= k:
+            self.var_names.append(('@@var_%d@@' % len(self.var_names)).encode('utf-8'))
+        return self.var_names[k]
+
+    def _token(self, j: int, names: Dict[str, int]) -> bytes:
+        if j < 0 or j >= len(self.enc):
+            return self.PAD
+
+        if self.enc[j] is not None:
+            return self.enc[j]
+
+        var = self.var[j]
+        if var not in names:
+            names[var] = len(names)
+        return self._var_name(names[var])
+
+    def _span(self, lo: int, hi: int, discriminator: bytes = b'') -> bytes:
+        '''Hash of the tokens in [lo, hi), padded outside of the function.'''
+        names = {}
+        raw = b'\xff'.join([self._token(j, names) for j in range(lo, hi)]) + discriminator
+        return hashlib.sha256(raw).digest()[:12]
+
+    def centered(self, i: int, sizes: List[int]) -> Dict[int, bytes]:
+        return {size: self._span(i - size, i + size + 1) for size in sizes}
+
+    def left(self, i: int, sizes: List[int]) -> Dict[int, bytes]:
+        return {size: self._span(i - size, i, b'left') for size in sizes}
+
+    def right(self, i: int, sizes: List[int]) -> Dict[int, bytes]:
+        wanted = set(sizes)
+        out = {}
+
+        if 0 in wanted:
+            out[0] = hashlib.sha256(b'right').digest()[:12]
+
+        longest = max(wanted, default=0)
+        if longest <= 0:
+            return out
+
+        h = hashlib.sha256()
+        names = {}
+        for size in range(1, longest + 1):
+            if size > 1:
+                h.update(b'\xff')
+            h.update(self._token(i + size, names))
+
+            if size in wanted:
+                snap = h.copy()
+                snap.update(b'right')
+                out[size] = snap.digest()[:12]
+
+        return out
+
+
 def process_one(entry: 'Entry', label: str, size: int, flanking: bool = False):
     labels = entry.labels(label)
 
@@ -53,38 +138,143 @@ def process_one(entry: 'Entry', label: str, size: int, flanking: bool = False):
     return hmap
 
 
+def process_many(entry: 'Entry', label: str, sizes: List[int], flanking: bool = False):
+    '''Like process_one for several sizes at once. Returns {size -> hmap}.'''
+    labels = entry.labels(label)
+
+    # size -> hash -> {var -> count}
+    hmaps = {size: {} for size in sizes}
+
+    for _idx, var, hashes in entry.iter_ngram_hashes(sizes, flanking=flanking):
+        if not labels[var].human:
+            # Skip non-human labels
+            continue
+
+        target = labels[var].label
+
+        for size, hsh in hashes.items():
+            hmap = hmaps[size]
+            if hsh not in hmap:
+                hmap[hsh] = {}
+            if target not in hmap[hsh]:
+                hmap[hsh][target] = 0
+            hmap[hsh][target] += 1
+
+    return hmaps
+
+
+def process_ids(entry: 'Entry', label: str, sizes: List[int], flanking: bool = False):
+    '''
+    Like process_many, but targets are indices into a per-function list of
+    labels so that the caller maps each label string once per function.
+    Returns (targets, {size -> hash -> {target index -> count}}).
+    '''
+    labels = entry.labels(label)
+
+    targets = []
+    local = {}
+
+    hmaps = {size: {} for size in sizes}
+
+    for _idx, var, hashes in entry.iter_ngram_hashes(sizes, flanking=flanking):
+        if not labels[var].human:
+            # Skip non-human labels
+            continue
+
+        target = labels[var].label
+        if target not in local:
+            local[target] = len(targets)
+            targets.append(target)
+        t = local[target]
+
+        for size, hsh in hashes.items():
+            hmap = hmaps[size]
+            if hsh not in hmap:
+                hmap[hsh] = {}
+            if t not in hmap[hsh]:
+                hmap[hsh][t] = 0
+            hmap[hsh][t] += 1
+
+    return targets, hmaps
+
+
+class NGramCounts(object):
+    '''
+    Merged output of process_ids over many functions: targets numbered in the
+    order they are first seen, {size -> hash -> {target id -> count}} and the
+    label counts (see vocab.count_labels).
+    '''
+    def __init__(self, sizes: List[int]):
+        self.targets = {}
+        self.hmaps = {size: {} for size in sizes}
+        self.label_counts = {}
+
+    def add(self, targets: List[str], hmaps, label_counts: Dict[str, int]):
+        # Label strings are resolved once per function (or per slice)
+        ids = [self.targets.setdefault(t, len(self.targets)) for t in targets]
+        for size, hmap in self.hmaps.items():
+            merge_ids(hmap, hmaps[size], ids)
+
+        merge_counts(self.label_counts, label_counts)
+
+    def result(self):
+        return list(self.targets), self.hmaps, self.label_counts
+
+
 class Processor:
-    def __init__(self, label, size, flanking):
+    '''Counts the N-grams of a corpus slice in a worker, which reads and parses the functions itself.'''
+    def __init__(self, label, sizes, flanking, with_label_counts=False):
         self.label = label
-        self.size = size
+        self.sizes = sizes
         self.flanking = flanking
+        self.with_label_counts = with_label_counts
 
-    def __call__(self, entry: 'Entry'):
-        return process_one(entry, self.label, self.size, self.flanking)
+    def __call__(self, part: 'CorpusSlice'):
+        counts = NGramCounts(self.sizes)
+        for entry in part:
+            targets, hmaps = process_ids(entry, self.label, self.sizes, self.flanking)
+            counts.add(targets, hmaps, count_labels(entry, self.label) if self.with_label_counts else {})
+        return counts.result()
 
 
-def build_ngram_db_multi(corpus: 'Corpus', vocab: Vocab, label: str, size: int, topk: int, flanking: bool) -> NGramDBMulti:
-    proc = Processor(label, size, flanking)
-    with multiprocessing.Pool() as pool:
-        hmaps = list(tqdm(pool.imap_unordered(proc, corpus)))
+def merge_hmap(hmap, sub):
+    '''Merges a per-function hash -> {target -> count} map into hmap in place.'''
+    for h in sub:
+        if not h in hmap:
+            hmap[h] = sub[h]
+        else:
+            for target in sub[h]:
+                if target not in hmap[h]:
+                    hmap[h][target] = 0
+                hmap[h][target] += sub[h][target]
 
-    hmap = {}
-    for sub in tqdm(hmaps, desc='Merging'):
-        for h in sub:
-            if not h in hmap:
-                hmap[h] = sub[h]
-            else:
-                for target in sub[h]:
-                    if target not in hmap[h]:
-                        hmap[h][target] = 0
-                    hmap[h][target] += sub[h][target]
 
+def merge_ids(hmap, sub, ids: List[int]):
+    '''Like merge_hmap for a process_ids map, renaming target indices through ids.'''
+    for h, row in sub.items():
+        row = {ids[t]: c for t, c in row.items()}
+        if not h in hmap:
+            hmap[h] = row
+        else:
+            dst = hmap[h]
+            for target, c in row.items():
+                if target not in dst:
+                    dst[target] = 0
+                dst[target] += c
+
+
+def finalize_hmap(hmap, ids: List[int], size: int, topk: int) -> NGramDBMulti:
+    '''
+    Keeps the top-k targets for each hash and builds the sorted database arrays.
+    Targets in hmap are indices into ids, the vocab id of each target (None
+    for targets which are not in the vocab).
+    '''
     # (hash, total, [(t1, c2), (t2, c2), ..., (tk, ck)])
     entries = []
 
     for h in tqdm(hmap, desc='Max'):
         top = sorted(hmap[h].items(), key=lambda x: x[1], reverse=True)[:topk]
-        top = [(vocab.lookup(x[0]), x[1]) for x in top if vocab.lookup(x[0]) is not None]
+        top = [(ids[x[0]], x[1]) for x in top if ids[x[0]] is not None]
 
         # If there are fewer than topk unique targets, pad with nulls
         while len(top) < topk:
@@ -100,9 +290,109 @@ def build_ngram_db_multi(corpus: 'Corpus', vocab: Vocab, label: str, size: int,
 
     hsh = np.array([x[0] for x in entries], dtype='|S12')
     total = np.array([x[1] for x in entries], dtype=np.uint32)
-    typ = np.array([[h[0] for h in x[2]] for x in entries], dtype=np.uint32)
-    counts = np.array([[h[1] for h in x[2]] for x in entries], dtype=np.uint32)
+    typ = np.array([[h[0] for h in x[2]] for x in entries], dtype=np.uint32).reshape(-1, topk)
+    counts = np.array([[h[1] for h in x[2]] for x in entries], dtype=np.uint32).reshape(-1, topk)
 
     db = NGramDBMulti(size, hsh, total, typ, counts)
     print(db)
     return db
+
+
+def _collect(corpus: 'Corpus', proc: Processor, sizes: List[int], nproc: int = None, chunk: int = 64):
+    '''
+    Runs proc over slices of chunk functions and merges the results in corpus
+    order, so that tied targets keep the same order whatever the number of
+    processes. Returns (targets, {size -> hmap}, label counts), see
+    NGramCounts.
+    '''
+    counts = NGramCounts(sizes)
+    parts = corpus.split(chunk)
+
+    with multiprocessing.Pool(processes=nproc) as pool:
+        for res in tqdm(pool.imap(proc, parts), total=len(parts), desc='Counting'):
+            counts.add(*res)
+
+    return counts.result()
+
+
+def build_ngram_dbs(corpus: 'Corpus', vocab: Vocab, label: str, sizes: List[int], topk: int, flanking: bool, max_memory: int = None, tmpdir: str = None, nproc: int = None, chunk: int = 64) -> List[NGramDBMulti]:
+    '''
+    Builds the databases for several N-gram sizes in a single pass over the
+    corpus. The corpus is split into slices of chunk functions (see
+    Corpus.split), and each of the nproc workers reads, parses and counts
+    its slices itself.
+
+    If max_memory (bytes) is set, counts are spilled to sorted runs in tmpdir
+    and merged from disk instead of being held in memory.
+    '''
+    if max_memory is not None:
+        return _build_ngram_dbs_spill(corpus, vocab, label, sizes, topk, flanking, max_memory, tmpdir, nproc, chunk)
+
+    targets, hmaps, _ = _collect(corpus, Processor(label, sizes, flanking), sizes, nproc=nproc, chunk=chunk)
+    ids = [vocab.lookup(t) for t in targets]
+
+    dbs = []
+    for size in sizes:
+        dbs.append(finalize_hmap(hmaps.pop(size), ids, size, topk))
+
+    return dbs
+
+
+def build_vocab_and_ngram_dbs(corpus: 'Corpus', label: str, sizes: List[int], topk: int, flanking: bool, nproc: int = None, chunk: int = 64) -> Tuple[Vocab, List[NGramDBMulti]]:
+    '''
+    Builds the vocab (same as Vocab.build_vocab) and the databases (same as
+    build_ngram_dbs with that vocab) in a single pass over the corpus.
+    '''
+    targets, hmaps, label_counts = _collect(corpus, Processor(label, sizes, flanking, with_label_counts=True), sizes, nproc=nproc, chunk=chunk)
+
+    vocab = Vocab.from_counts(label_counts)
+    print(vocab)
+    ids = [vocab.lookup(t) for t in targets]
+
+    dbs = []
+    for size in sizes:
+        dbs.append(finalize_hmap(hmaps.pop(size), ids, size, topk))
+
+    return vocab, dbs
+
+
+def _build_ngram_dbs_spill(corpus: 'Corpus', vocab: Vocab, label: str, sizes: List[int], topk: int, flanking: bool, max_memory: int, tmpdir: str, nproc: int = None, chunk: int = 64) -> List[NGramDBMulti]:
+    proc = Processor(label, sizes, flanking)
+
+    # Targets missing from the vocab still get distinct ids so that they are
+    # counted and ranked exactly like in the in-memory build.
+    nvocab = len(vocab.entries)
+    unknown = {}
+
+    def label_id(target):
+        i = vocab.lookup(target)
+        if i is None:
+            i = unknown.setdefault(target, nvocab + len(unknown))
+        return i
+
+    max_records = max_memory // RECORD_COST // len(sizes)
+
+    with tempfile.TemporaryDirectory(dir=tmpdir) as d:
+        builders = {size: SpillBuilder(d, max_records, name='ngram.%d' % size) for size in sizes}
+
+        parts = corpus.split(chunk)
+        with multiprocessing.Pool(processes=nproc) as pool:
+            for local, sub, _ in tqdm(pool.imap_unordered(proc, parts), total=len(parts), desc='Counting'):
+                ids = [label_id(t) for t in local]
+                for size in sizes:
+                    builder = builders[size]
+                    for h, targets in sub[size].items():
+                        for t, count in targets.items():
+                            builder.add(h, ids[t], count)
+
+        dbs = []
+        for size in sizes:
+            db = builders.pop(size).finalize(size, topk, nvocab)
+            print(db)
+            dbs.append(db)
+
+    return dbs
+
+
+def build_ngram_db_multi(corpus: 'Corpus', vocab: Vocab, label: str, size: int, topk: int, flanking: bool) -> NGramDBMulti:
+    return build_ngram_dbs(corpus, vocab, label, [size], topk, flanking)[0]
@@ -0,0 +1,188 @@
+import functools
+import re
+from typing import List
+
+
+GHIDRA_STACK = re.compile('[a-z]*Stack_[0-9]+')
+
+GHIDRA_VAR = re.compile('[a-z]*Var[0-9]+')
+
+GHIDRA_ADDR_STRING = re.compile('s_[a-zA-Z0-9_]+[a-fA-F0-9]{8}')
+GHIDRA_ADDR_PTR = re.compile('PTR_[a-zA-Z0-9_]+[a-fA-F0-9]{8}')
+
+HEXNUM = re.compile('0x[0-9a-fA-F]+')
+DECNUM = re.compile('[0-9]+')
+
+PREFIXES = [
+    # IDA
+    'sub_', 'loc_', 'unk_', 'off_', 'asc_', 'stru_', 'funcs_',
+    'byte_', 'word_', 'dword_', 'qword_', 'xmmword_', 'ymmword_',
+    'LABEL_',
+
+    # Ghidra
+    'FUN_', 'thunk_FUN_',
+    'LAB_', 'joined_r0x', # goto labels
+    'DAT_', '_DAT_', 'code_r0x', 'uRam', # data and code labels
+    'switchD_', 'switchdataD_', 'caseD_', # switch labels
+]
+
+FULL_STRIP = '''
+?
+Number
+String
+L
+
+__int8
+__int16
+__int32
+__int64
+LODWORD
+const
+_BYTE
+_WORD
+_DWORD
+_QWORD
+char
+float
+double
+__fastcall
+unsigned
+void
+
+break
+if
+else
+while
+int
+void
+goto
+
+[
+]
+(
+)
+{
+}
++
+-
+,
+;
+*
+*=
+<
+>
+=
+<=
+>=
+==
+!=
+++
+--
++=
+-=
+<<
+>>
+<<=
+>>=
+!
+|
+||
+|=
+&
+&&
+&=
+/
+/=
+^
+^=
+%
+%=
+'''
+
+FULL_STRIP = [x for x in FULL_STRIP.split() if x != '']
+
+
+# The rules are applied in order and the last matching one wins, so the
+# full-match rules are tried from the last to the first in a single regex.
+# Alternation in a fullmatch picks the first alternative that matches the
+# whole token.
+_FULLMATCH = re.compile('|'.join('(?P<%s>%s)' % (name, rule.pattern) for name, rule in [
+    ('decnum', DECNUM),
+    ('hexnum', HEXNUM),
+    ('addr_ptr', GHIDRA_ADDR_PTR),
+    ('addr_string', GHIDRA_ADDR_STRING),
+    ('ghidra_var', GHIDRA_VAR),
+    ('ghidra_stack', GHIDRA_STACK),
+]))
+
+# First matching prefix wins, like the alternation order.
+_PREFIX = re.compile('|'.join(re.escape(p) for p in PREFIXES))
+
+
+def _number(val: int) -> str:
+    if val >= 0x100:
+        hex_digits = len(hex(val)[2:])
+        return '<NUM_%d>' % hex_digits
+    return hex(val)
+
+
+def normalize_token(tok: str) -> str:
+    '''Normalizes a single decompiler token (addresses, numbers, strings, Ghidra temporaries).'''
+    m = _FULLMATCH.fullmatch(tok)
+    if m is not None:
+        kind = m.lastgroup
+        if kind == 'decnum':
+            return _number(int(tok))
+        elif kind == 'hexnum':
+            return _number(int(tok, 16))
+        elif kind == 'addr_ptr' or kind == 'addr_string':
+            return tok[:-8]
+        elif kind == 'ghidra_var':
+            return '<ghidra_var>'
+        else:
+            return '<ghidra_stack>'
+
+    if tok.startswith('"') and tok.endswith('"'):
+        return '<STRING>'
+
+    m = _PREFIX.match(tok)
+    if m is not None:
+        return m.group(0) + 'XXX'
+
+    return tok
+
+
+class Normalizer(object):
+    '''
+    Token normalizer with a bounded per-token memo cache.
+
+    Decompiled code reuses a small set of tokens millions of times, so each
+    distinct token is only run through the rules once. With full_strip=True
+    every token outside of FULL_STRIP becomes '?'.
+    '''
+    def __init__(self, full_strip: bool = False, cache_size: int = 1 << 20):
+        self.full_strip = full_strip
+        self.normalize = functools.lru_cache(maxsize=cache_size)(self._normalize)
+
+    def _normalize(self, tok: str) -> str:
+        norm = normalize_token(tok)
+        if self.full_strip and norm not in _FULL_STRIP_SET:
+            return '?'
+        return norm
+
+    def __call__(self, tokens: List[str]) -> List[str]:
+        normalize = self.normalize
+        return [normalize(tok) for tok in tokens]
+
+
+_FULL_STRIP_SET = frozenset(FULL_STRIP)
+
+_NORMALIZERS = {
+    False: Normalizer(full_strip=False),
+    True: Normalizer(full_strip=True),
+}
+
+
+def normalize_tokens(tokens: List[str], full_strip: bool = False) -> List[str]:
+    '''Normalizes a token stream with the shared, cached normalizers.'''
+    return _NORMALIZERS[full_strip](tokens)
@@ -0,0 +1,260 @@
+'''
+Hash-partitioned database builds.
+
+The hash space is split into P contiguous ranges by the leading hash bits.
+After a plan step has recorded the settings and the corpus slices, a build
+runs in three steps which only share files in a work directory, so each
+step can run on any core or node:
+
+    map:     counts the N-grams of one share of the corpus slices (reading
+             only their byte ranges) and writes the
+             records of each (size, partition) as sorted runs
+    reduce:  merges the runs of one partition into a sorted database part
+    concat:  concatenates the parts in partition order, which is already
+             sorted, into the final databases
+
+The result is the same as build_ngram_dbs with max_memory.
+'''
+import glob
+import json
+import os
+from typing import Dict, List
+
+import numpy as np
+
+from .corpus import CorpusSlice
+from .db import NGramDBMulti
+from .ngram import Processor
+from .spill import CHUNK, RECORD, RECORD_COST, _sum_duplicates, merge_runs
+from .vocab import Vocab
+
+
+JOB = 'job.json'
+SLICES = 'slices.npz'
+
+
+def partition_of(hsh, partitions: int) -> np.ndarray:
+    '''Partition of each 12-byte hash: partition p holds the p-th of partitions equal ranges of hash values.'''
+    raw = np.ascontiguousarray(np.asarray(hsh, dtype='|S12')).view(np.uint8).reshape(-1, 12)
+    prefix = np.ascontiguousarray(raw[:, :4]).view('>u4').ravel().astype(np.uint64)
+    return ((prefix * np.uint64(partitions)) >> np.uint64(32)).astype(np.int64)
+
+
+def _run_path(workdir: str, task: int, size: int, partition: int, run: int) -> str:
+    return os.path.join(workdir, 'map.%05d.%d.%05d.%d.bin' % (task, size, partition, run))
+
+
+def _unknown_path(workdir: str, task: int) -> str:
+    return os.path.join(workdir, 'unknown.%05d.json' % task)
+
+
+def _part_path(workdir: str, size: int, partition: int) -> str:
+    return os.path.join(workdir, 'part.%d.%05d.db' % (size, partition))
+
+
+def write_job(workdir: str, label: str, sizes: List[int], topk: int, flanking: bool, partitions: int, nvocab: int):
+    '''Records the build settings that reduce and concat need.'''
+    os.makedirs(workdir, exist_ok=True)
+    job = {
+        'label': label,
+        'sizes': sizes,
+        'topk': topk,
+        'flanking': flanking,
+        'partitions': partitions,
+        'nvocab': nvocab,
+    }
+    with open(os.path.join(workdir, JOB), 'w') as f:
+        json.dump(job, f, indent=2)
+
+
+def load_job(workdir: str) -> Dict:
+    with open(os.path.join(workdir, JOB), 'r') as f:
+        return json.load(f)
+
+
+def write_slices(workdir: str, corpus: 'Corpus', chunk: int = 64):
+    '''
+    Splits the corpus once (see Corpus.split) and records the slices, so map
+    tasks do not each scan the whole corpus for line offsets.
+    '''
+    parts = corpus.split(chunk)
+
+    files = {}
+    for part in parts:
+        files.setdefault(part.path, len(files))
+
+    np.savez(
+        os.path.join(workdir, SLICES),
+        files=np.array(list(files), dtype=str),
+        ranges=np.array([(files[p.path], p.start, p.end) for p in parts], dtype=np.int64).reshape(-1, 3),
+        full_strip=corpus.full_strip,
+        compiled=corpus.compiled is not None,
+    )
+
+
+def load_slices(workdir: str) -> List[CorpusSlice]:
+    with np.load(os.path.join(workdir, SLICES)) as f:
+        files = f['files'].tolist()
+        full_strip = bool(f['full_strip'])
+        compiled = bool(f['compiled'])
+        return [
+            CorpusSlice(files[k], start, end, full_strip, compiled)
+            for k, start, end in f['ranges'].tolist()
+        ]
+
+
+class PartitionWriter(object):
+    '''
+    Buffers (hash, label id, count) records of one map task. Once
+    max_records are buffered they are summed, sorted and written as one run
+    per (size, partition).
+    '''
+    def __init__(self, workdir: str, task: int, sizes: List[int], partitions: int, max_records: int):
+        self.workdir = workdir
+        self.task = task
+        self.partitions = partitions
+        self.max_records = max(max_records, CHUNK)
+
+        self.pending = {size: [] for size in sizes}
+        self.chunks = {size: [] for size in sizes}
+        self.buffered = 0
+        self.runs = 0
+
+    def add(self, size: int, hsh: bytes, label: int, count: int):
+        pending = self.pending[size]
+        pending.append((hsh, label, count))
+        if len(pending) >= CHUNK:
+            self._pack(size)
+
+    def _pack(self, size: int):
+        pending = self.pending[size]
+        if len(pending) == 0:
+            return
+
+        self.chunks[size].append(np.array(pending, dtype=RECORD))
+        self.buffered += len(pending)
+        self.pending[size] = []
+
+        if self.buffered >= self.max_records:
+            self.flush()
+
+    def flush(self):
+        '''Writes the buffered records as one sorted run per (size, partition).'''
+        for size in self.pending:
+            if len(self.pending[size]) > 0:
+                self.chunks[size].append(np.array(self.pending[size], dtype=RECORD))
+                self.pending[size] = []
+
+        for size, chunks in self.chunks.items():
+            if len(chunks) == 0:
+                continue
+
+            rec = _sum_duplicates(np.concatenate(chunks))
+            bounds = np.searchsorted(partition_of(rec['hsh'], self.partitions), np.arange(self.partitions + 1))
+            for p in range(self.partitions):
+                if bounds[p+1] > bounds[p]:
+                    rec[bounds[p]:bounds[p+1]].tofile(_run_path(self.workdir, self.task, size, p, self.runs))
+
+        self.chunks = {size: [] for size in self.chunks}
+        self.buffered = 0
+        self.runs += 1
+
+
+def map_task(vocab: Vocab, workdir: str, task: int, tasks: int, max_memory: int = 1 << 30):
+    '''
+    Counts the N-grams of map task number task (of tasks), which is a
+    contiguous range of the corpus slices recorded by write_slices.
+    '''
+    job = load_job(workdir)
+    sizes = job['sizes']
+
+    parts = load_slices(workdir)
+    parts = parts[task * len(parts) // tasks:(task + 1) * len(parts) // tasks]
+
+    # Labels missing from the vocab get ids past the vocab in the order this
+    # task first sees them. They are counted and ranked but not stored, and
+    # reduce renumbers them consistently across tasks (see unknown_ids).
+    nvocab = len(vocab.entries)
+    unknown = {}
+
+    def label_id(target):
+        i = vocab.lookup(target)
+        if i is None:
+            i = unknown.setdefault(target, nvocab + len(unknown))
+        return i
+
+    # Runs left over from an earlier attempt of this task
+    for path in glob.glob(os.path.join(workdir, 'map.%05d.*.bin' % task)) + glob.glob(_unknown_path(workdir, task)):
+        os.remove(path)
+
+    proc = Processor(job['label'], sizes, job['flanking'])
+    writer = PartitionWriter(workdir, task, sizes, job['partitions'], max_memory // RECORD_COST)
+
+    for part in parts:
+        local, sub, _ = proc(part)
+        ids = [label_id(t) for t in local]
+        for size in sizes:
+            for h, targets in sub[size].items():
+                for t, count in targets.items():
+                    writer.add(size, h, ids[t], count)
+
+    writer.flush()
+
+    with open(_unknown_path(workdir, task), 'w') as f:
+        json.dump(list(unknown), f)
+
+
+def unknown_ids(workdir: str, tasks: List[int], nvocab: int) -> Dict[int, np.ndarray]:
+    '''
+    Maps the task local ids of labels missing from the vocab to ids shared
+    by every task: nvocab plus the rank of the label among all missing
+    labels. Returns {task -> global id of each local id - nvocab}.
+    '''
+    local = {}
+    for task in tasks:
+        path = _unknown_path(workdir, task)
+        if not os.path.exists(path):
+            raise ValueError('Map task %d did not finish (missing %s)' % (task, path))
+        with open(path, 'r') as f:
+            local[task] = json.load(f)
+
+    rank = {t: nvocab + i for i, t in enumerate(sorted(set(t for labels in local.values() for t in labels)))}
+    if nvocab + len(rank) > np.iinfo(np.uint32).max:
+        raise ValueError('Too many labels missing from the vocab')
+
+    return {task: np.array([rank[t] for t in labels], dtype=np.uint32) for task, labels in local.items()}
+
+
+def reduce_task(workdir: str, partition: int):
+    '''Merges the runs of one partition into one database part per size.'''
+    job = load_job(workdir)
+    nvocab = job['nvocab']
+
+    runs = {size: sorted(glob.glob(os.path.join(workdir, 'map.*.%d.%05d.*.bin' % (size, partition)))) for size in job['sizes']}
+    task_of = lambda path: int(os.path.basename(path).split('.')[1])
+    ids = unknown_ids(workdir, sorted(set(task_of(path) for paths in runs.values() for path in paths)), nvocab)
+
+    for size, paths in runs.items():
+        db = merge_runs(paths, size, job['topk'], nvocab, remap=[ids[task_of(path)] for path in paths])
+        db.save(_part_path(workdir, size, partition))
+
+
+def concat(workdir: str) -> List[NGramDBMulti]:
+    '''Concatenates the reduced parts into one database per size.'''
+    job = load_job(workdir)
+
+    dbs = []
+    for size in job['sizes']:
+        parts = [NGramDBMulti.load(_part_path(workdir, size, p)) for p in range(job['partitions'])]
+        db = NGramDBMulti(
+            size,
+            np.concatenate([x.hsh for x in parts]),
+            np.concatenate([x.total for x in parts]),
+            np.concatenate([x.typ for x in parts]),
+            np.concatenate([x.counts for x in parts]),
+        )
+        if np.any(db.hsh[1:] <= db.hsh[:-1]):
+            raise ValueError('Database parts of size %d are not sorted, were they built with the same partitions?' % size)
+        dbs.append(db)
+
+    return dbs
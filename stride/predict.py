@@ -1,91 +1,195 @@
 
 
+from contextlib import nullcontext
 from typing import List
 
 import numpy as np
 
-from .db import NGramDB, NGramDBMulti
+from .db import NGramDBMulti
 from .corpus import Entry
+from .profile import Profile
 from .vocab import Vocab
 
 
-def predict_multi(entry: Entry, vocab: Vocab, dbs: List[NGramDBMulti], label: str, flanking: bool = False):
+def _targets(vocab: Vocab, typ, counts):
+    '''Converts a row of (typ, counts) from the database into a list of (name, count).'''
+    entries = []
+    for t, c in zip(typ, counts):
+        if c == 0:
+            continue
+
+        name = vocab.reverse(t)
+        if name is None:
+            continue
+
+        entries.append((name, c))
+
+    return entries
+
+
+def _all_sizes(dbs: List[NGramDBMulti]) -> List[int]:
+    return sorted(set(size for db in dbs for size in db.sizes), reverse=True)
+
+
+def _no_timer(stage: str):
+    return nullcontext()
+
+
+def predict_multi(entry: Entry, vocab: Vocab, dbs: List[NGramDBMulti], label: str, flanking: bool = False, profile: Profile = None):
     '''
     Makes a prediction for all variables in a given function.
 
     Args:
         entry: The function to predict on (dict from STRIDE Corpus).
         vocab: The vocabulary to use.
-        dbs: list of NGramDBs to use (sorted largest to smallest).
+        dbs: list of NGramDBs to use (sorted largest to smallest). A single
+            multi-size database (see NGramDBMulti.merge) may be used instead.
         label: The label to predict.
+        profile: Optional Profile to collect stage timings and hit counts in.
     '''
-    locs = {}
-    preds = {}
+    return predict_batch([entry], vocab, dbs, label, flanking, profile)[0]
 
-    for hsh, _span, idx, var in entry.iter_ngrams(1, flanking=flanking):
-        if var not in locs:
-            locs[var] = []
-        locs[var].append(idx)
-        preds[idx] = None
 
+def predict_batch(entries: List[Entry], vocab: Vocab, dbs: List[NGramDBMulti], label: str, flanking: bool = False, profile: Profile = None):
+    '''
+    Same as predict_multi for a batch of functions. The lookups for every
+    function in the batch are shared, so each database is queried once per
+    batch instead of once per function.
+
+    The backoff and scoring run on arrays: a (position, size) key matrix, a
+    per-position top-k row taken from the largest size that hits, and
+    (variable, label id) score sums. Names are only looked up for the final
+    predictions.
+    '''
+    sizes = _all_sizes(dbs)
+    col = {size: i for i, size in enumerate(sizes)}
+
+    timer = _no_timer
+    if profile is not None:
+        timer = profile.timer
+        profile.counts['batches'] += 1
+
+        # Normalize up front so it is timed separately from hashing
+        with timer('normalize'):
+            for entry in entries:
+                entry.stripped_tokens
+                profile.function(len(entry.tokens))
+
+    # Global variable index -> (function, variable name)
+    var_fn = []
+    var_names = []
+
+    # Per position: global variable index and hashes for every size
+    pos_var = []
+    keys = []
+
+    with timer('hash'):
+        for k, entry in enumerate(entries):
+            local = {}
+            for _idx, var, hashes in entry.iter_ngram_hashes(sizes, flanking=flanking):
+                if var not in local:
+                    local[var] = len(var_names)
+                    var_fn.append(k)
+                    var_names.append(var)
+
+                pos_var.append(local[var])
+                keys.extend(hashes[size] for size in sizes)
+
+    out = [{} for _ in entries]
+    for k, var in zip(var_fn, var_names):
+        out[k][var] = None
+
+    npos = len(pos_var)
+    if npos == 0 or len(dbs) == 0:
+        return out
+
+    keys = np.array(keys, dtype='|S12').reshape(npos, len(sizes))
+    pos_var = np.array(pos_var, dtype=np.int64)
+
+    with timer('lookup'):
+        typ, counts = _backoff(keys, col, dbs, profile)
+
+    with timer('aggregate'):
+        _aggregate(out, typ, counts, pos_var, var_fn, var_names, vocab)
+
+    return out
+
+
+def _backoff(keys, col, dbs: List[NGramDBMulti], profile: Profile = None):
+    '''Each position takes the top-k row of the largest size that hits.'''
+    npos = len(keys)
+    topk = max(db.topk for db in dbs)
+    typ = np.zeros((npos, topk), dtype=np.uint32)
+    counts = np.zeros((npos, topk), dtype=np.uint32)
+
+    unresolved = np.arange(npos)
     for db in dbs:
-        for hsh, span, idx, var in entry.iter_ngrams(db.size, flanking=flanking):
-            if preds[idx] is not None:
-                continue
+        if len(unresolved) == 0:
+            break
 
-            res = db.lookup(hsh)
-            if res is None:
-                continue
+        # (size, position) matrix, largest size first. A multi-size database
+        # resolves all of its sizes in a single query.
+        query = keys[unresolved][:, [col[size] for size in db.sizes]].T
+        hit, _total, db_typ, db_counts = db.lookup_many(query.ravel())
+        hit = hit.reshape(query.shape)
 
-            total, targets = res
+        found = hit.any(axis=0)
+        first = hit.argmax(axis=0)
+        rows = (first * len(unresolved) + np.arange(len(unresolved)))[found]
 
-            entries = []
-            for t, c in targets:
-                if c == 0:
-                    continue
+        width = db_typ.shape[1]
+        typ[unresolved[found], :width] = db_typ[rows]
+        counts[unresolved[found], :width] = db_counts[rows]
 
-                name = vocab.reverse(t)
-                if name is None:
-                    continue
+        if profile is not None:
+            for j, size in enumerate(db.sizes):
+                profile.lookups[size] += len(unresolved)
+                profile.hits[size] += int(hit[j].sum())
+            for j, n in zip(*np.unique(first[found], return_counts=True)):
+                profile.resolved[db.sizes[j]] += int(n)
 
-                entries.append((name, c))
+        unresolved = unresolved[~found]
 
-            preds[idx] = (db.size, total, entries)
+    if profile is not None:
+        profile.counts['positions'] += npos
+        profile.resolved[None] += len(unresolved)
 
-    # Aggregate predictions by variable
-    agg = {}
-    for var in locs:
-        agg[var] = {}
-        for idx in locs[var]:
-            if preds[idx] is None:
-                continue
+    return typ, counts
+
+
+def _aggregate(out, typ, counts, pos_var, var_fn, var_names, vocab: Vocab):
+    '''Scores the top-k rows of every position and writes the best label per variable into out.'''
+    npos, topk = typ.shape
 
-            size, total, entries = preds[idx]
-            entry_total = sum(x[1] for x in entries)
+    # Score each target: map its ratio within the position into [0.5, 1]
+    valid = counts > 0
+    entry_total = counts.sum(axis=1, dtype=np.uint64)
+    score = counts / np.maximum(entry_total, 1)[:, None] * 0.5 + 0.5
 
-            for name, count in entries:
-                if name not in agg[var]:
-                    agg[var][name] = 0
-                
-                # map ratio into [0.5, 1]
-                score = (count / entry_total) * 0.5 + 0.5
+    # Sum the scores per (variable, label). Cells are visited in position
+    # order, which keeps the float sums identical to a sequential loop.
+    nvocab = len(vocab.entries)
+    if np.any(typ[valid] >= nvocab):
+        raise IndexError('Database label id out of range for the vocab')
 
-                agg[var][name] += score
+    cell_key = (np.repeat(pos_var, topk).reshape(npos, topk) * nvocab + typ)[valid]
+    if len(cell_key) == 0:
+        return
 
-    # Find the best prediction for each variable
-    for var in agg:
-        best = None
-        for name in agg[var]:
-            if best is None or agg[var][name] > agg[var][best]:
-                best = name
-            elif agg[var][name] == agg[var][best]:
-                # Tiebreack by vocab frequency
-                if vocab.count_by_id(vocab.lookup(name)) > vocab.count_by_id(vocab.lookup(best)):
-                    best = name
+    uniq, first, inverse = np.unique(cell_key, return_index=True, return_inverse=True)
+    sums = np.zeros(len(uniq))
+    np.add.at(sums, inverse.ravel(), score[valid])
 
-        agg[var] = best
+    agg_var = uniq // nvocab
+    agg_label = uniq % nvocab
 
-    return agg
+    # Best label per variable: highest score, then vocab frequency, then the
+    # label that was seen first.
+    order = np.lexsort((first, -vocab.count_array[agg_label], -sums, agg_var))
+    best = order[np.r_[True, agg_var[order][1:] != agg_var[order][:-1]]]
+
+    for v, t in zip(agg_var[best].tolist(), agg_label[best].tolist()):
+        out[var_fn[v]][var_names[v]] = vocab.reverse(t)
 
 
 def predict_detailed(entry: Entry, vocab: Vocab, dbs: List[NGramDBMulti], label: str, flanking: bool = False):
@@ -95,7 +199,8 @@ def predict_detailed(entry: Entry, vocab: Vocab, dbs: List[NGramDBMulti], label:
     Args:
         entry: The function to predict on (dict from STRIDE Corpus).
         vocab: The vocabulary to use.
-        dbs: list of NGramDBs to use (sorted largest to smallest).
+        dbs: list of NGramDBs to use (sorted largest to smallest). A single
+            multi-size database (see NGramDBMulti.merge) may be used instead.
         label: The label to predict.
     '''
 
@@ -105,32 +210,31 @@ def predict_detailed(entry: Entry, vocab: Vocab, dbs: List[NGramDBMulti], label:
     # [idx][db_size] -> [[name, count], ...]
     preds = {}
 
-    for hsh, _span, idx, var in entry.iter_ngrams(1, flanking=flanking):
+    grams = list(entry.iter_ngram_hashes(_all_sizes(dbs), flanking=flanking))
+
+    for idx, var, _hashes in grams:
         if var not in locs:
             locs[var] = []
         locs[var].append(idx)
         preds[idx] = {}
 
-    for db in dbs:
-        for hsh, span, idx, var in entry.iter_ngrams(db.size, flanking=flanking):
-            res = db.lookup(hsh)
-            if res is None:
-                preds[idx][int(db.size)] = []
-                continue
-
-            _total, targets = res
+    if len(grams) == 0:
+        return preds, locs
 
-            entries = []
-            for t, c in targets:
-                if c == 0:
-                    continue
+    for db in dbs:
+        queries = [
+            (size, hashes[size], idx)
+            for size in db.sizes
+            for idx, _var, hashes in grams
+        ]
 
-                name = vocab.reverse(t)
-                if name is None:
-                    continue
+        hit, _total, typ, counts = db.lookup_many([x[1] for x in queries])
 
-                entries.append((name, int(c)))
+        for i, (size, _hsh, idx) in enumerate(queries):
+            if not hit[i]:
+                preds[idx][size] = []
+                continue
 
-            preds[idx][int(db.size)] = entries
+            preds[idx][size] = [(name, int(c)) for name, c in _targets(vocab, typ[i], counts[i])]
 
     return preds, locs
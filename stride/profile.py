@@ -0,0 +1,65 @@
+from collections import Counter
+from contextlib import contextmanager
+import time
+from typing import Dict
+
+
+class Profile(object):
+    '''
+    Accumulates per-stage timings and counters while predicting.
+
+    Everything is a plain sum or histogram, so profiles collected in separate
+    workers can be combined with merge. Code paths take an optional profile
+    and skip all bookkeeping when it is None.
+    '''
+    def __init__(self):
+        # stage -> seconds
+        self.times = Counter()
+        # name -> count
+        self.counts = Counter()
+        # size -> lookups, hits
+        self.lookups = Counter()
+        self.hits = Counter()
+        # size -> positions resolved at that size (None: no size hit)
+        self.resolved = Counter()
+        # power of two bucket -> functions with at most that many tokens
+        self.lengths = Counter()
+
+    @contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[stage] += time.perf_counter() - start
+
+    def function(self, ntokens: int):
+        self.counts['functions'] += 1
+        self.counts['tokens'] += ntokens
+        self.lengths[1 << max(0, ntokens - 1).bit_length()] += 1
+
+    def merge(self, other: 'Profile'):
+        for name in ['times', 'counts', 'lookups', 'hits', 'resolved', 'lengths']:
+            getattr(self, name).update(getattr(other, name))
+
+    def report(self) -> Dict:
+        return {
+            'times': dict(sorted(self.times.items())),
+            'counts': dict(sorted(self.counts.items())),
+            'lookups': {
+                str(size): {
+                    'lookups': self.lookups[size],
+                    'hits': self.hits[size],
+                    'misses': self.lookups[size] - self.hits[size],
+                    'hit_rate': self.hits[size] / self.lookups[size] if self.lookups[size] > 0 else 0.0,
+                }
+                for size in sorted(self.lookups, reverse=True)
+            },
+            'resolved_by_size': {
+                ('none' if size is None else str(size)): n
+                for size, n in sorted(self.resolved.items(), key=lambda x: -1 if x[0] is None else x[0], reverse=True)
+            },
+            'function_tokens': {
+                ('<=%d' % bucket): n for bucket, n in sorted(self.lengths.items())
+            },
+        }
@@ -0,0 +1,168 @@
+from functools import partial
+import multiprocessing
+from typing import Dict, List, Tuple
+
+from tqdm.auto import tqdm
+import numpy as np
+
+from .db import NGramDBMulti
+from .index import _key64
+
+
+def _links_slice(part: 'CorpusSlice', sizes: List[int], flanking: bool):
+    child = [[] for _ in sizes[:-1]]
+    parent = [[] for _ in sizes[:-1]]
+    for entry in part:
+        for _idx, _var, hashes in entry.iter_ngram_hashes(sizes, flanking=flanking):
+            for i in range(len(sizes) - 1):
+                child[i].append(hashes[sizes[i]])
+                parent[i].append(hashes[sizes[i+1]])
+
+    out = []
+    for c, p in zip(child, parent):
+        c, first = np.unique(np.array(c, dtype='|S12'), return_index=True)
+        out.append((c, np.array(p, dtype='|S12')[first]))
+    return out
+
+
+def parent_links(corpus: 'Corpus', sizes: List[int], flanking: bool = False, nproc: int = None, chunk: int = 64) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    '''
+    Finds the backoff parent of every N-gram in the corpus: the N-gram of the
+    next smaller size at the same position. A span contains the spans of all
+    smaller sizes at its position, so each hash has exactly one parent.
+
+    Returns {size -> (hashes, parent hashes)} for every size but the smallest,
+    sorted and unique by hash.
+    '''
+    sizes = sorted(sizes, reverse=True)
+    parts = corpus.split(chunk)
+
+    links = [([], []) for _ in sizes[:-1]]
+    with multiprocessing.Pool(processes=nproc) as pool:
+        for res in tqdm(pool.imap_unordered(partial(_links_slice, sizes=sizes, flanking=flanking), parts), total=len(parts), desc='Linking'):
+            for (c, p), (cs, ps) in zip(res, links):
+                cs.append(c)
+                ps.append(p)
+
+    out = {}
+    for size, (cs, ps) in zip(sizes, links):
+        c, first = np.unique(np.concatenate(cs) if len(cs) > 0 else np.zeros(0, dtype='|S12'), return_index=True)
+        out[size] = (c, np.concatenate(ps)[first] if len(ps) > 0 else c)
+    return out
+
+
+def _find(db: NGramDBMulti, keys) -> np.ndarray:
+    '''Index of each key in db, -1 for keys which are not in it.'''
+    hsh = db.hsh
+    if hsh.dtype == np.uint64:
+        keys = _key64(keys)
+
+    if len(hsh) == 0:
+        return np.full(len(keys), -1, dtype=np.int64)
+
+    idx = np.searchsorted(hsh, keys)
+    idx[idx == len(hsh)] = 0
+    return np.where(hsh[idx] == keys, idx, -1)
+
+
+def _same_rows(typ_a, counts_a, typ_b, counts_b) -> np.ndarray:
+    '''
+    True for rows which give every target the same score in predict_multi:
+    the same targets in the same order with proportional counts.
+    '''
+    counts_a = counts_a.astype(np.uint64)
+    counts_b = counts_b.astype(np.uint64)
+    sum_a = counts_a.sum(axis=1, keepdims=True)
+    sum_b = counts_b.sum(axis=1, keepdims=True)
+
+    valid_a = counts_a > 0
+    valid_b = counts_b > 0
+    same = (valid_a == valid_b) & (~valid_a | (typ_a == typ_b)) & (counts_a * sum_b == counts_b * sum_a)
+    return same.all(axis=1) & (sum_a[:, 0] > 0)
+
+
+def _pad(arr, topk: int):
+    return np.pad(np.asarray(arr), ((0, 0), (0, topk - arr.shape[1])))
+
+
+class PruneResult(object):
+    '''Entries kept per size, and why the others were removed.'''
+    def __init__(self):
+        self.keep = {}
+        self.redundant = {}
+        self.support = {}
+
+    def subset(self, dbs: Dict[int, NGramDBMulti]) -> Dict[int, NGramDBMulti]:
+        '''The pruned databases.'''
+        out = {}
+        for size, db in dbs.items():
+            keep = self.keep[size]
+            out[size] = NGramDBMulti(size, db.hsh[keep], db.total[keep], db.typ[keep], db.counts[keep])
+            if db.filter is not None:
+                out[size].build_filter(db.filter.nbytes * 8 / max(len(db.hsh), 1))
+        return out
+
+
+def prune_cascade(dbs: Dict[int, NGramDBMulti], links: Dict[int, Tuple[np.ndarray, np.ndarray]], min_total: int = 1, support_sizes: List[int] = None) -> PruneResult:
+    '''
+    Prunes a backoff cascade of single-size databases ({size -> db}, queried
+    largest size first as in predict_multi).
+
+    An entry is removed if it is below the support threshold (total <
+    min_total, only for support_sizes if given), or if it is redundant: its
+    parent, or whatever the position would fall back to once pruned parents
+    are skipped, scores the same targets the same way. Removing a redundant
+    entry cannot change any prediction. Entries whose parent is not known
+    from links are kept.
+    '''
+    sizes = sorted(dbs)
+    topk = max(db.topk for db in dbs.values())
+
+    # Rows of all sizes back to back, eff points at the row a lookup of each
+    # entry ends up using after pruning (-1 for none)
+    base = {}
+    offset = 0
+    for size in sizes:
+        base[size] = offset
+        offset += len(dbs[size].hsh)
+
+    all_typ = np.concatenate([_pad(dbs[size].typ, topk) for size in sizes])
+    all_counts = np.concatenate([_pad(dbs[size].counts, topk) for size in sizes])
+
+    result = PruneResult()
+    prev = None
+    prev_eff = None
+    for size in tqdm(sizes, desc='Pruning'):
+        db = dbs[size]
+        n = len(db.hsh)
+        own = base[size] + np.arange(n)
+
+        if support_sizes is None or size in support_sizes:
+            supported = np.asarray(db.total) >= min_total
+        else:
+            supported = np.ones(n, dtype=bool)
+
+        parent_eff = np.full(n, -1, dtype=np.int64)
+        if prev is not None and size in links:
+            child, parent = links[size]
+            ci = _find(db, child)
+            pi = _find(dbs[prev], parent)
+            valid = (ci >= 0) & (pi >= 0)
+            parent_eff[ci[valid]] = prev_eff[pi[valid]]
+
+        redundant = np.zeros(n, dtype=bool)
+        cand = np.flatnonzero(supported & (parent_eff >= 0))
+        redundant[cand] = _same_rows(
+            all_typ[own[cand]], all_counts[own[cand]],
+            all_typ[parent_eff[cand]], all_counts[parent_eff[cand]],
+        )
+
+        keep = supported & ~redundant
+        result.keep[size] = keep
+        result.redundant[size] = int(redundant.sum())
+        result.support[size] = int((~supported).sum())
+
+        prev = size
+        prev_eff = np.where(keep, own, parent_eff)
+
+    return result
@@ -0,0 +1,248 @@
+from abc import ABC, abstractmethod
+import csv
+import json
+import os
+from typing import Dict
+
+
+class ResultWriter(ABC):
+    '''
+    Writes prediction rows (dicts) to disk as they are produced. The format
+    is chosen by the file extension, see open_writer. Columns are the keys
+    in the order they are first seen; rows may add new (meta) columns at any
+    point.
+
+    Use as a context manager so the file is closed on errors too. close may
+    be called early and is then a no-op on exit.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self.columns = []
+        self.known = set()
+        self.count = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _add_columns(self, row: Dict) -> bool:
+        '''Records new columns of row, returns True if there were any.'''
+        new = False
+        for k in row:
+            if k not in self.known:
+                self.known.add(k)
+                self.columns.append(k)
+                new = True
+        return new
+
+    @abstractmethod
+    def write(self, row: Dict):
+        pass
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._close()
+
+    def _close(self):
+        pass
+
+
+class JSONLWriter(ResultWriter):
+    '''One JSON object per line.'''
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.f = open(path, 'w')
+
+    def write(self, row: Dict):
+        self._add_columns(row)
+        self.f.write(json.dumps(row) + '\n')
+        self.count += 1
+
+    def _close(self):
+        self.f.close()
+
+
+class CSVWriter(ResultWriter):
+    '''
+    CSV with a header row. Missing values are left empty. If a column shows
+    up after the header was written, the file is rewritten once on close
+    (streamed, so memory stays flat) with the full header.
+    '''
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.f = open(path, 'w', newline='')
+        self.writer = csv.writer(self.f, lineterminator='\n')
+        self.header = None
+
+    def write(self, row: Dict):
+        self._add_columns(row)
+        if self.header is None:
+            self.header = list(self.columns)
+            self.writer.writerow(self.header)
+
+        self.writer.writerow([row.get(c) for c in self.columns])
+        self.count += 1
+
+    def _close(self):
+        self.f.close()
+
+        if self.header is None or len(self.header) == len(self.columns):
+            return
+
+        # Columns are only appended, so earlier rows just need padding
+        tmp = self.path + '.tmp'
+        with open(self.path, 'r', newline='') as src, open(tmp, 'w', newline='') as dst:
+            reader = csv.reader(src)
+            writer = csv.writer(dst, lineterminator='\n')
+            next(reader)
+            writer.writerow(self.columns)
+            for row in reader:
+                writer.writerow(row + [''] * (len(self.columns) - len(row)))
+
+        os.replace(tmp, self.path)
+
+
+class ParquetWriter(ResultWriter):
+    '''
+    Parquet, written in row groups of chunk_size rows (needs pyarrow).
+
+    Each chunk holds every column seen so far and is cast to the schema of
+    the file. A chunk which does not fit (new columns, or a column that was
+    all null so far) starts a new part file, and on close the parts are
+    merged batch by batch into one file with the unified schema. Columns
+    whose values have types that cannot be unified (e.g. int in one row and
+    str in another) are stored as strings.
+    '''
+    def __init__(self, path: str, chunk_size: int = 65536):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('Writing parquet needs pyarrow (pip install pyarrow)')
+
+        super().__init__(path)
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.chunk_size = chunk_size
+        self.rows = []
+        self.parts = []
+        self.writer = None
+
+    def write(self, row: Dict):
+        self._add_columns(row)
+        self.rows.append(row)
+        self.count += 1
+        if len(self.rows) >= self.chunk_size:
+            self._flush()
+
+    def _errors(self):
+        pa = self.pa
+        return (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError)
+
+    def _array(self, values):
+        '''Arrow array of values, as strings if they have no common type.'''
+        try:
+            return self.pa.array(values)
+        except self._errors():
+            return self.pa.array([None if v is None else str(v) for v in values], type=self.pa.string())
+
+    def _cast(self, column, typ):
+        try:
+            return column.cast(typ)
+        except self._errors():
+            if typ != self.pa.string():
+                raise
+            return self._array([None if v is None else str(v) for v in column.to_pylist()])
+
+    def _conform(self, table, schema, lossy: bool = False):
+        '''
+        Casts table to schema, or returns None if it does not fit. With lossy,
+        values which cannot be cast to a string column are converted with str.
+        '''
+        if not set(table.column_names) <= set(schema.names):
+            return None
+
+        pa = self.pa
+        columns = [
+            table.column(f.name) if f.name in table.column_names else pa.nulls(len(table), f.type)
+            for f in schema
+        ]
+        try:
+            if lossy:
+                return pa.table([self._cast(c, f.type) for c, f in zip(columns, schema)], schema=schema)
+            return pa.table(columns, names=schema.names).cast(schema)
+        except self._errors():
+            return None
+
+    def _unify(self, schemas):
+        '''Unified schema over self.columns, falling back to string for fields with incompatible types.'''
+        pa = self.pa
+        fields = []
+        for c in self.columns:
+            types = [s.field(c) for s in schemas if c in s.names]
+            try:
+                fields.append(pa.unify_schemas([pa.schema([f]) for f in types], promote_options='permissive').field(c))
+            except self._errors():
+                fields.append(pa.field(c, pa.string()))
+        return pa.schema(fields)
+
+    def _flush(self):
+        if len(self.rows) == 0:
+            return
+
+        # Every known column, so keys missing from the first rows are kept
+        table = self.pa.table({c: self._array([r.get(c) for r in self.rows]) for c in self.columns})
+        self.rows = []
+
+        if self.writer is not None:
+            conformed = self._conform(table, self.writer.schema)
+            if conformed is not None:
+                self.writer.write_table(conformed)
+                return
+            self.writer.close()
+
+        part = '%s.part%d' % (self.path, len(self.parts))
+        self.parts.append(part)
+        self.writer = self.pq.ParquetWriter(part, table.schema)
+        self.writer.write_table(table)
+
+    def _close(self):
+        self._flush()
+        if self.writer is not None:
+            self.writer.close()
+
+        if len(self.parts) == 0:
+            # No rows: an empty file with no columns
+            self.pq.write_table(self.pa.table({}), self.path)
+            return
+
+        if len(self.parts) == 1:
+            os.replace(self.parts[0], self.path)
+            return
+
+        schema = self._unify([self.pq.read_schema(part) for part in self.parts])
+
+        with self.pq.ParquetWriter(self.path, schema) as writer:
+            for part in self.parts:
+                for batch in self.pq.ParquetFile(part).iter_batches():
+                    writer.write_table(self._conform(self.pa.Table.from_batches([batch]), schema, lossy=True))
+                os.remove(part)
+
+
+WRITERS = {
+    '.csv': CSVWriter,
+    '.jsonl': JSONLWriter,
+    '.parquet': ParquetWriter,
+}
+
+
+def open_writer(path: str) -> ResultWriter:
+    '''Opens a writer for path, picking the format from its extension (.csv, .jsonl or .parquet).'''
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in WRITERS:
+        raise ValueError('Unsupported output format %r (expected one of %s)' % (ext, ', '.join(sorted(WRITERS))))
+    return WRITERS[ext](path)
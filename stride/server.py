@@ -0,0 +1,197 @@
+import argparse
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from typing import Dict, List
+
+from .corpus import Entry
+from .db import NGramDBMulti, with_deltas
+from .predict import predict_batch
+from .vocab import Vocab
+
+
+class Predictor(object):
+    '''
+    Keeps the databases and vocab resident and micro-batches concurrent
+    requests: functions submitted within max_wait seconds of each other (up
+    to max_batch) are predicted together with shared database lookups.
+    '''
+    def __init__(self, vocab: Vocab, dbs: List[NGramDBMulti], label: str, flanking: bool = False, full_strip: bool = False, max_batch: int = 64, max_wait: float = 0.002):
+        self.vocab = vocab
+        self.dbs = dbs
+        self.label = label
+        self.flanking = flanking
+        self.full_strip = full_strip
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, raw: Dict) -> Future:
+        '''Queues one function (a dict in STRIDE corpus format, labels are optional).'''
+        # Validate here so a malformed function cannot fail the whole batch
+        if not isinstance(raw, dict) or not isinstance(raw.get('tokens'), list) or not all(isinstance(x, str) for x in raw['tokens']):
+            raise ValueError('function must be a dict with a list of string tokens')
+
+        future = Future()
+        self.queue.put((Entry(raw, full_strip=self.full_strip), future))
+        return future
+
+    def predict(self, functions: List[Dict]) -> List[Dict[str, str]]:
+        futures = [self.submit(raw) for raw in functions]
+        return [f.result() for f in futures]
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            try:
+                preds = predict_batch([x[0] for x in batch], self.vocab, self.dbs, self.label, self.flanking)
+            except Exception as e:
+                for _entry, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_entry, future), pred in zip(batch, preds):
+                future.set_result(pred)
+
+
+class Handler(BaseHTTPRequestHandler):
+    '''
+    POST /predict with {"functions": [...]} returns {"predictions": [...]},
+    one {var: prediction} dict per function (same as predict_multi).
+    GET /health returns the loaded database sizes.
+    '''
+    predictor = None
+
+    # Responses always carry a Content-Length, so connections can be reused
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # Headers and body are written separately; avoid Nagle/delayed ACK stalls
+        if self.connection.family in (socket.AF_INET, socket.AF_INET6):
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _send(self, code: int, body: Dict):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != '/health':
+            self._send(404, {'error': 'not found'})
+            return
+
+        self._send(200, {
+            'status': 'ok',
+            'sizes': [size for db in self.predictor.dbs for size in db.sizes],
+            'vocab': len(self.predictor.vocab.entries),
+        })
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send(404, {'error': 'not found'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            functions = json.loads(self.rfile.read(length))['functions']
+            if not isinstance(functions, list):
+                raise TypeError('functions must be a list')
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {'error': 'bad request: %s' % e})
+            return
+
+        try:
+            preds = self.predictor.predict(functions)
+        except ValueError as e:
+            self._send(400, {'error': 'bad function: %s' % e})
+            return
+
+        self._send(200, {'predictions': preds})
+
+    def address_string(self):
+        # Unix socket clients have no (host, port) address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def serve(predictor: Predictor, host: str = '127.0.0.1', port: int = 8765, unix: str = None):
+    handler = type('BoundHandler', (Handler,), {'predictor': predictor})
+
+    if unix is not None:
+        server = UnixHTTPServer(unix, handler)
+        print('Serving on unix:%s' % unix)
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        server.daemon_threads = True
+        print('Serving on http://%s:%d' % (host, server.server_port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(args):
+    dbs = [NGramDBMulti.load(path, mmap=args.mmap) for path in args.dbs]
+    dbs = with_deltas(dbs, [NGramDBMulti.load(path) for path in args.deltas])
+    vocab = Vocab.load(args.vocab)
+
+    predictor = Predictor(vocab, dbs, args.type, args.flanking, args.strip, args.max_batch, args.max_wait / 1000)
+    serve(predictor, args.host, args.port, args.unix)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('vocab', help='Path to label.vocab')
+    parser.add_argument('--dbs', '-d', nargs='+', help='Path to ngram.db')
+    parser.add_argument('--deltas', nargs='+', default=[], help='Delta databases to layer onto the --dbs with the same sizes')
+    parser.add_argument('--type', '-t', choices=['name', 'type'], default='name', help='Label type')
+    parser.add_argument('--flanking', '-f', action='store_true', help='Use flanking ngrams', default=False)
+    parser.add_argument('--strip', action='store_true', default=False)
+    parser.add_argument('--mmap', action='store_true', help='Memory-map the databases', default=False)
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on')
+    parser.add_argument('--unix', default=None, help='Listen on a unix socket instead of TCP')
+    parser.add_argument('--max-batch', type=int, default=64, help='Maximum number of functions per lookup batch')
+    parser.add_argument('--max-wait', type=float, default=2.0, help='Milliseconds to wait for more requests to batch')
+    args = parser.parse_args()
+    main(args)
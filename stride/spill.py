@@ -0,0 +1,212 @@
+import os
+from typing import List
+
+import numpy as np
+
+from .db import NGramDBMulti
+
+
+# One (hash, label id, count) observation.
+RECORD = np.dtype([('hsh', '|S12'), ('label', np.uint32), ('count', np.uint32)])
+
+# Rough number of bytes of memory needed per buffered record, including the
+# Python objects held before a chunk is packed and the sort temporaries.
+RECORD_COST = 128
+
+# Records appended as Python tuples before they are packed into an array.
+CHUNK = 1 << 16
+
+
+def _sum_duplicates(rec):
+    '''Sorts records by (hash, label) and sums the counts of duplicates.'''
+    rec = np.sort(rec, order=('hsh', 'label'))
+    if len(rec) == 0:
+        return rec
+
+    start = np.ones(len(rec), dtype=bool)
+    start[1:] = (rec['hsh'][1:] != rec['hsh'][:-1]) | (rec['label'][1:] != rec['label'][:-1])
+    start = np.flatnonzero(start)
+
+    out = rec[start]
+    out['count'] = np.add.reduceat(rec['count'].astype(np.uint64), start)
+    return out
+
+
+def reduce_records(rec, topk: int, nvocab: int):
+    '''
+    Reduces a batch of records holding complete hash groups into database rows.
+
+    Targets are ranked by count (ties broken by label id, i.e. by vocab
+    frequency). Labels with an id >= nvocab are not in the vocab: like the
+    in-memory builder they count towards the total and take a top-k slot, but
+    are not stored.
+
+    Returns (hsh, total, typ, counts) sorted by hash.
+    '''
+    rec = _sum_duplicates(rec)
+    if len(rec) == 0:
+        return (
+            np.zeros(0, dtype='|S12'),
+            np.zeros(0, dtype=np.uint32),
+            np.zeros((0, topk), dtype=np.uint32),
+            np.zeros((0, topk), dtype=np.uint32),
+        )
+
+    start = np.ones(len(rec), dtype=bool)
+    start[1:] = rec['hsh'][1:] != rec['hsh'][:-1]
+    group = np.cumsum(start) - 1
+    start = np.flatnonzero(start)
+
+    hsh = rec['hsh'][start]
+    total = np.add.reduceat(rec['count'].astype(np.uint64), start).astype(np.uint32)
+
+    # Rank targets within each hash by count (descending), then label.
+    order = np.lexsort((rec['label'], -rec['count'].astype(np.int64), group))
+    rank = np.arange(len(rec)) - start[group[order]]
+
+    keep = order[rank < topk]
+    keep = keep[rec['label'][keep] < nvocab]
+
+    # Known targets shift left to fill the slots of dropped unknown ones.
+    kept_group = group[keep]
+    first = np.searchsorted(kept_group, kept_group, side='left')
+    slot = np.arange(len(keep)) - first
+
+    typ = np.zeros((len(hsh), topk), dtype=np.uint32)
+    counts = np.zeros((len(hsh), topk), dtype=np.uint32)
+    typ[kept_group, slot] = rec['label'][keep]
+    counts[kept_group, slot] = rec['count'][keep]
+
+    return hsh, total, typ, counts
+
+
+def _block_end(run, pos: int, block: int) -> int:
+    '''Returns the end of the block starting at pos, extended so that it does not split a hash group.'''
+    end = min(pos + block, len(run))
+    last = run['hsh'][end-1]
+
+    # Only search bounded slices: searching the strided memmap field directly
+    # would copy the whole run into memory.
+    while end < len(run):
+        tail = run['hsh'][end:end+block]
+        n = np.searchsorted(tail, last, side='right')
+        end += n
+        if n < len(tail):
+            break
+
+    return end
+
+
+class SpillBuilder(object):
+    '''
+    Accumulates (hash, label id, count) records with bounded memory.
+
+    Records are buffered until max_records is reached, then sorted, reduced
+    and written to disk as a sorted run. finalize k-way merges the runs into
+    the final database.
+    '''
+    def __init__(self, tmpdir: str, max_records: int, name: str = 'run'):
+        self.tmpdir = tmpdir
+        self.max_records = max(max_records, CHUNK)
+        self.name = name
+
+        self.pending = []
+        self.chunks = []
+        self.buffered = 0
+        self.runs = []
+
+    def add(self, hsh: bytes, label: int, count: int):
+        self.pending.append((hsh, label, count))
+        if len(self.pending) >= CHUNK:
+            self._pack()
+
+    def _pack(self):
+        if len(self.pending) == 0:
+            return
+
+        self.chunks.append(np.array(self.pending, dtype=RECORD))
+        self.buffered += len(self.pending)
+        self.pending = []
+
+        if self.buffered >= self.max_records:
+            self.spill()
+
+    def spill(self):
+        '''Writes the buffered records to disk as a sorted run.'''
+        self._pack()
+        if len(self.chunks) == 0:
+            return
+
+        rec = _sum_duplicates(np.concatenate(self.chunks))
+        self.chunks = []
+        self.buffered = 0
+
+        path = os.path.join(self.tmpdir, '%s.%d' % (self.name, len(self.runs)))
+        rec.tofile(path)
+        self.runs.append(path)
+
+    def finalize(self, size: int, topk: int, nvocab: int, block: int = 1 << 20) -> NGramDBMulti:
+        '''Merges the sorted runs into a database.'''
+        self.spill()
+
+        db = merge_runs(self.runs, size, topk, nvocab, block)
+
+        for path in self.runs:
+            os.remove(path)
+        self.runs = []
+
+        return db
+
+
+def merge_runs(paths: List[str], size: int, topk: int, nvocab: int, block: int = 1 << 20, remap: List[np.ndarray] = None) -> NGramDBMulti:
+    '''
+    K-way merges sorted runs of records (see SpillBuilder.spill) into a
+    database. If given, remap[i] renames the label ids >= nvocab of run i:
+    id becomes remap[i][id - nvocab].
+    '''
+    if remap is None:
+        remap = [None] * len(paths)
+
+    keep = [i for i, path in enumerate(paths) if os.path.getsize(path) > 0]
+    runs = [np.memmap(paths[i], dtype=RECORD, mode='r') for i in keep]
+    remap = [remap[i] for i in keep]
+    pos = [0] * len(runs)
+
+    parts = []
+    while True:
+        live = [i for i in range(len(runs)) if pos[i] < len(runs[i])]
+        if len(live) == 0:
+            break
+
+        # Read the next block of each run, extended to end on a hash boundary.
+        ends = {i: _block_end(runs[i], pos[i], block) for i in live}
+
+        # Every record up to the smallest block end is now in memory.
+        frontier = min(runs[i]['hsh'][ends[i]-1] for i in live)
+
+        batch = []
+        for i in live:
+            end = pos[i] + np.searchsorted(runs[i]['hsh'][pos[i]:ends[i]], frontier, side='right')
+            rec = np.array(runs[i][pos[i]:end])
+            if remap[i] is not None:
+                unknown = rec['label'] >= nvocab
+                rec['label'][unknown] = remap[i][rec['label'][unknown] - nvocab]
+            batch.append(rec)
+            pos[i] = end
+
+        parts.append(reduce_records(np.concatenate(batch), topk, nvocab))
+
+    if len(parts) == 0:
+        parts.append(reduce_records(np.zeros(0, dtype=RECORD), topk, nvocab))
+
+    hsh, total, typ, counts = (np.concatenate(x) for x in zip(*parts))
+    return NGramDBMulti(size, hsh, total, typ, counts)
+
+
+def parse_memory(value: str) -> int:
+    '''Parses a memory size such as 512M or 4G into bytes.'''
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    value = value.strip().upper().rstrip('B')
+    if value[-1:] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
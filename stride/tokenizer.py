@@ -0,0 +1,301 @@
+'''
+Fast tokenizer for Hex-Rays / Ghidra decompiler output.
+
+Produces exactly the tokens of lexer.Lexer(code).get_tokens() (the Pygments
+based HexRaysLexer): comments and whitespace are dropped, adjacent string
+pieces are collapsed into one token, '::' is dropped and @@var@@name@@
+placeholders are kept whole.
+
+The Pygments lexer is a state machine which tries every rule of the current
+state one at a time. Here the rules of each state (in the same order) are
+compiled into a single alternation, so each token costs one regex match.
+The rules mirror pygments.lexers.c_cpp.CLexer (Pygments 2.19) plus the
+HexRaysLexer additions. stride.tools.check_tokenizer compares both.
+'''
+import re
+from typing import List
+
+
+# Token kinds
+SKIP = 0         # whitespace and comments
+STRING = 1       # pieces of string and char literals
+NUMBER = 2
+PLACEHOLDER = 3  # @@var@@name@@
+SCOPE = 4        # the '::' operator
+OTHER = 5
+
+
+_WS1 = r'\s*(?:/[*].*?[*]/\s*)?'
+_HEXPART = r'[0-9a-fA-F](\'?[0-9a-fA-F])*'
+_DECPART = r'\d(\'?\d)*'
+_INTSUFFIX = r'(([uU][lL]{0,2})|[lL]{1,2}[uU]?)?'
+_IDENT = r'(?!\d)(?:[\w$]|\\u[0-9a-fA-F]{4}|\\U[0-9a-fA-F]{8})+'
+_NAMESPACED_IDENT = r'(?!\d)(?:[\w$]|\\u[0-9a-fA-F]{4}|\\U[0-9a-fA-F]{8}|::)+'
+_COMMENT_SINGLE = r'//(?:.|(?<=\\)\n)*\n'
+_COMMENT_MULTILINE = r'/(?:\\\n)?[*](?:[^*]|[*](?!(?:\\\n)?/))*[*](?:\\\n)?/'
+_POSSIBLE_COMMENTS = rf'\s*(?:(?:(?:{_COMMENT_SINGLE})|(?:{_COMMENT_MULTILINE}))\s*)*'
+
+
+def _words(words, prefix='', suffix=''):
+    return prefix + '(?:' + '|'.join(re.escape(w) for w in sorted(words, key=len, reverse=True)) + ')' + suffix
+
+
+def _using(*stack):
+    '''Group action: lex the group text on its own, starting from stack.'''
+    return ('using', stack)
+
+
+# A rule is (regex, action, new_state). The action is a token kind, None (no
+# token) or a tuple with one action per group, like Pygments' bygroups.
+# new_state is a tuple of state names, '#pop' and '#push'.
+
+_WHITESPACE = [
+    (r'^#if\s+0', SKIP, ('if0',)),
+    ('^#', SKIP, ('macro',)),
+    ('^(' + _WS1 + r')(#if\s+0)', (_using('root'), SKIP), ('if0',)),
+    ('^(' + _WS1 + ')(#)', (_using('root'), SKIP), ('macro',)),
+    (r'(^[ \t]*)(?!(?:public|private|protected|default)\b)(' + _IDENT + r')(\s*)(:)(?!:)', (SKIP, OTHER, SKIP, OTHER), None),
+    (r'\n', SKIP, None),
+    (r'[^\S\n]+', SKIP, None),
+    (r'\\\n', SKIP, None),
+    (_COMMENT_SINGLE, SKIP, None),
+    (_COMMENT_MULTILINE, SKIP, None),
+    (r'/(\\\n)?[*][\w\W]*', SKIP, None),
+]
+
+_KEYWORDS = [
+    (_words(('_Alignas', '_Alignof', '_Noreturn', '_Generic', '_Thread_local', '_Static_assert', '_Imaginary',
+             'noreturn', 'imaginary', 'complex'), suffix=r'\b'), OTHER, None),
+    (r'(struct|union)(\s+)', (OTHER, SKIP), ('classname',)),
+    (r'case\b', OTHER, ('case-value',)),
+    (_words(('asm', 'auto', 'break', 'const', 'continue', 'default', 'do', 'else', 'enum', 'extern', 'for', 'goto',
+             'if', 'register', 'restricted', 'return', 'sizeof', 'struct', 'static', 'switch', 'typedef', 'volatile',
+             'while', 'union', 'thread_local', 'alignas', 'alignof', 'static_assert', '_Pragma'), suffix=r'\b'), OTHER, None),
+    (_words(('inline', '_inline', '__inline', 'naked', 'restrict', 'thread'), suffix=r'\b'), OTHER, None),
+    (r'(__m(128i|128d|128|64))\b', OTHER, None),
+    (_words(('asm', 'based', 'except', 'stdcall', 'cdecl', 'fastcall', 'declspec', 'finally', 'try', 'leave', 'w64',
+             'unaligned', 'raise', 'noop', 'identifier', 'forceinline', 'assume'), prefix='__', suffix=r'\b'), OTHER, None),
+]
+
+_TYPES = [
+    (_words(('_Bool', '_Complex', '_Atomic'), suffix=r'\b'), OTHER, None),
+    (_words(('int8', 'int16', 'int32', 'int64', 'wchar_t'), prefix='__', suffix=r'\b'), OTHER, None),
+    (_words(('bool', 'int', 'long', 'float', 'short', 'double', 'char', 'unsigned', 'signed', 'void', '_BitInt',
+             '__int128'), suffix=r'\b'), OTHER, None),
+]
+
+_STATEMENTS = [
+    # HexRaysLexer additions
+    *[(op, OTHER, None) for op in [
+        r'->', r'\+\+', r'--', r'==', r'!=', r'>=', r'<=', r'&&', r'\|\|', r'\+=', r'-=', r'\*=', r'/=', r'%=',
+        r'&=', r'\^=', r'\|=', r'<<=', r'>>=', r'<<', r'>>', r'\.\.\.', r'##',
+    ]],
+    (r'::', SCOPE, None),
+    (r'@@\w+@@\w+@@', PLACEHOLDER, None),
+    # CLexer
+    *_KEYWORDS,
+    *_TYPES,
+    (r'([LuU]|u8)?(")', (STRING, STRING), ('string',)),
+    (r"([LuU]|u8)?(')(\\.|\\[0-7]{1,3}|\\x[a-fA-F0-9]{1,2}|[^\\\'\n])(')", (STRING, STRING, STRING, STRING), None),
+    (r'0[xX](' + _HEXPART + r'\.' + _HEXPART + r'|\.' + _HEXPART + r'|' + _HEXPART + r')[pP][+-]?' + _HEXPART + r'[lL]?', NUMBER, None),
+    (r'(-)?(' + _DECPART + r'\.' + _DECPART + r'|\.' + _DECPART + r'|' + _DECPART + r')[eE][+-]?' + _DECPART + r'[fFlL]?', NUMBER, None),
+    (r'(-)?((' + _DECPART + r'\.(' + _DECPART + r')?|\.' + _DECPART + r')[fFlL]?)|(' + _DECPART + r'[fFlL])', NUMBER, None),
+    (r'(-)?0[xX]' + _HEXPART + _INTSUFFIX, NUMBER, None),
+    (r'(-)?0[bB][01](\'?[01])*' + _INTSUFFIX, NUMBER, None),
+    (r'(-)?0(\'?[0-7])+' + _INTSUFFIX, NUMBER, None),
+    (r'(-)?' + _DECPART + _INTSUFFIX, NUMBER, None),
+    (r'[~!%^&*+=|?:<>/-]', OTHER, None),
+    (r'[()\[\],.]', OTHER, None),
+    (r'(true|false|NULL)\b', OTHER, None),
+    (_IDENT, OTHER, None),
+]
+
+_FUNCTION_GROUPS = (
+    _using('root'), _using('root', 'whitespace'), OTHER, _using('root', 'whitespace'),
+    _using('root'), _using('root', 'whitespace'), _using('root'), OTHER,
+)
+
+_FUNCTION_HEAD = (
+    r'(' + _NAMESPACED_IDENT + r'(?:[&*\s])+)'
+    r'(' + _POSSIBLE_COMMENTS + r')'
+    r'(' + _NAMESPACED_IDENT + r')'
+    r'(' + _POSSIBLE_COMMENTS + r')'
+    r'(\([^;"\')]*?\))'
+    r'(' + _POSSIBLE_COMMENTS + r')'
+)
+
+_STATES = {
+    'whitespace': _WHITESPACE,
+    'root': [
+        *_WHITESPACE,
+        *_KEYWORDS,
+        # function definitions and declarations
+        (_FUNCTION_HEAD + r'([^;{/"\']*)(\{)', _FUNCTION_GROUPS, ('function',)),
+        (_FUNCTION_HEAD + r'([^;/"\']*)(;)', _FUNCTION_GROUPS, None),
+        *_TYPES,
+        ('', None, ('statement',)),
+    ],
+    'statement': [
+        *_WHITESPACE,
+        *_STATEMENTS,
+        (r'\}', OTHER, None),
+        (r'[{;]', OTHER, ('#pop',)),
+    ],
+    'function': [
+        *_WHITESPACE,
+        *_STATEMENTS,
+        (';', OTHER, None),
+        (r'\{', OTHER, ('#push',)),
+        (r'\}', OTHER, ('#pop',)),
+    ],
+    'string': [
+        (r'"', STRING, ('#pop',)),
+        (r'\\([\\abfnrtv"\']|x[a-fA-F0-9]{2,4}|u[a-fA-F0-9]{4}|U[a-fA-F0-9]{8}|[0-7]{1,3})', STRING, None),
+        (r'[^\\"\n]+', STRING, None),
+        (r'\\\n', STRING, None),
+        (r'\\', STRING, None),
+    ],
+    'macro': [
+        (r'(' + _WS1 + r')(include)(' + _WS1 + r')("[^"]+")([^\n]*)', (_using('root'), SKIP, _using('root'), SKIP, SKIP), None),
+        (r'(' + _WS1 + r')(include)(' + _WS1 + r')(<[^>]+>)([^\n]*)', (_using('root'), SKIP, _using('root'), SKIP, SKIP), None),
+        (r'[^/\n]+', SKIP, None),
+        (r'/[*](.|\n)*?[*]/', SKIP, None),
+        (r'//.*?\n', SKIP, ('#pop',)),
+        (r'/', SKIP, None),
+        (r'(?<=\\)\n', SKIP, None),
+        (r'\n', SKIP, ('#pop',)),
+    ],
+    'if0': [
+        (r'^\s*#if.*?(?<!\\)\n', SKIP, ('#push',)),
+        (r'^\s*#el(?:se|if).*\n', SKIP, ('#pop',)),
+        (r'^\s*#endif.*?(?<!\\)\n', SKIP, ('#pop',)),
+        (r'.*?\n', SKIP, None),
+    ],
+    'classname': [
+        (_IDENT, OTHER, ('#pop',)),
+        (r'\s*(?=>)', SKIP, ('#pop',)),
+        ('', None, ('#pop',)),
+    ],
+    'case-value': [
+        (r'(?<!:)(:)(?!:)', OTHER, ('#pop',)),
+        (_IDENT, OTHER, None),
+        *_WHITESPACE,
+        *_STATEMENTS,
+    ],
+}
+
+
+def _compile(rules):
+    '''
+    Joins the rules of a state into one regex. Returns the regex and, per
+    group number of a rule, (first group of the rule, action, new state).
+    '''
+    parts = []
+    table = {}
+    group = 1
+    for regex, action, new_state in rules:
+        parts.append('(' + regex + ')')
+        table[group] = (group, action, new_state)
+        group += 1 + re.compile(regex).groups
+
+    return re.compile('|'.join(parts), re.MULTILINE), table
+
+
+_COMPILED = {name: _compile(rules) for name, rules in _STATES.items()}
+
+# Shortcut for the common tokens in statements: away from the start of a line
+# no earlier rule can match a plain word, a bracket, a comma or a run of
+# blanks, and keywords are OTHER tokens just like identifiers. Words that
+# change state ('case', 'struct', 'union') or may continue as a string prefix
+# or an escaped identifier take the full path.
+_FAST = re.compile(r'([^\W\d]\w*(?![\w$\\"\'])|[()\[\],])|[^\S\n]+')
+_FAST_STATES = ('statement', 'function')
+_SLOW_WORDS = ('case', 'struct', 'union')
+
+
+def _lex(text: str, stack=('root',)):
+    '''Yields (kind, value) pairs, following RegexLexer.get_tokens_unprocessed.'''
+    pos = 0
+    stack = list(stack)
+    regex, table = _COMPILED[stack[-1]]
+    fast = stack[-1] in _FAST_STATES
+    n = len(text)
+
+    while True:
+        if fast and pos > 0 and text[pos - 1] != '\n':
+            m = _FAST.match(text, pos)
+            if m is not None and m.group(1) not in _SLOW_WORDS:
+                yield (SKIP if m.group(1) is None else OTHER), m.group()
+                pos = m.end()
+                continue
+
+        m = regex.match(text, pos)
+        if m is None:
+            if pos >= n:
+                break
+            if text[pos] == '\n':
+                # At EOL, reset to root
+                stack = ['root']
+                regex, table = _COMPILED['root']
+                fast = False
+                yield SKIP, '\n'
+            else:
+                yield OTHER, text[pos]
+            pos += 1
+            continue
+
+        first, action, new_state = table[m.lastindex]
+        if type(action) is int:
+            yield action, m.group()
+        elif action is not None:
+            for i, group_action in enumerate(action):
+                data = m.group(first + 1 + i)
+                if type(group_action) is int:
+                    if data:
+                        yield group_action, data
+                elif data is not None:
+                    yield from _lex(data, group_action[1])
+
+        pos = m.end()
+        if new_state is not None:
+            for state in new_state:
+                if state == '#pop':
+                    if len(stack) > 1:
+                        stack.pop()
+                elif state == '#push':
+                    stack.append(stack[-1])
+                else:
+                    stack.append(state)
+            regex, table = _COMPILED[stack[-1]]
+            fast = stack[-1] in _FAST_STATES
+
+
+def _prepare(code: str) -> str:
+    '''Same input normalization as Pygments (BOM, newlines, stripnl, ensurenl).'''
+    if code.startswith('\ufeff'):
+        code = code[1:]
+    code = code.replace('\r\n', '\n').replace('\r', '\n').strip('\n')
+    if not code.endswith('\n'):
+        code += '\n'
+    return code
+
+
+def tokenize(code: str) -> List[str]:
+    '''Tokenizes decompiled code, same as [tok[1] for tok in Lexer(code).get_tokens()].'''
+    out = []
+    string = None
+    for kind, value in _lex(_prepare(code)):
+        if kind == STRING:
+            string = value if string is None else string + value
+            continue
+
+        if string is not None:
+            out.append(string)
+            string = None
+
+        if kind == NUMBER or kind == PLACEHOLDER:
+            out.append(value)
+        elif kind == OTHER:
+            out.append(value.strip())
+
+    return out
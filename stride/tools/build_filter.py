@@ -0,0 +1,97 @@
+import argparse
+import json
+import time
+
+from tqdm.auto import tqdm
+import numpy as np
+
+from ..corpus import Corpus
+from ..db import NGramDBMulti
+
+
+def _time(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure(db: NGramDBMulti, queries) -> dict:
+    '''Measures the false-positive rate of db.filter and the lookup time it saves on queries.'''
+    queries = np.asarray(queries, dtype='|S12')
+
+    flt = db.filter
+    db.filter = None
+    hit, _, _, _ = db.lookup_many(queries)
+    t_plain = _time(lambda: db.lookup_many(queries))
+
+    db.filter = flt
+    t_filter = _time(lambda: db.lookup_many(queries))
+
+    maybe = flt.contains_many(queries)
+    misses = ~hit
+
+    return {
+        'queries': len(queries),
+        'hit_rate': float(hit.mean()) if len(queries) > 0 else 0.0,
+        'false_positive_rate': float(maybe[misses].mean()) if misses.any() else 0.0,
+        'lookup_seconds': t_plain,
+        'lookup_seconds_filtered': t_filter,
+        'seconds_saved': t_plain - t_filter,
+    }
+
+
+def main(args):
+    sizes = set()
+    dbs = []
+    for path in args.dbs:
+        db = NGramDBMulti.load(path)
+        db.build_filter(args.bits_per_key)
+        dbs.append((path, db))
+        sizes.update(db.sizes)
+
+    # size -> query hashes, either from a corpus or random (all misses)
+    queries = {}
+    if args.corpus is not None:
+        sizes = sorted(sizes, reverse=True)
+        hashes = {size: [] for size in sizes}
+        for entry, _ in zip(tqdm(Corpus(args.corpus, full_strip=args.strip), desc='Hashing'), range(args.limit)):
+            for _idx, _var, h in entry.iter_ngram_hashes(sizes, flanking=args.flanking):
+                for size in sizes:
+                    hashes[size].append(h[size])
+        queries = {size: np.array(h, dtype='|S12') for size, h in hashes.items()}
+
+    report = {}
+    for path, db in dbs:
+        if args.corpus is not None:
+            q = np.concatenate([queries[size] for size in db.sizes])
+        else:
+            q = np.random.default_rng(0).integers(0, 256, size=(args.limit, 12), dtype=np.uint8).view('|S12').ravel()
+
+        report[path] = {
+            'entries': len(db.hsh),
+            'filter_bytes': db.filter.nbytes,
+            'hsh_bytes': db.hsh.nbytes,
+        }
+        report[path].update(measure(db, q))
+
+        if not args.dry_run:
+            db.save(path)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Adds a Bloom filter to existing databases and reports its effect')
+    parser.add_argument('dbs', nargs='+', help='Path to ngram.db files (rewritten in place)')
+    parser.add_argument('--bits-per-key', '-b', type=float, default=10, help='Filter bits per entry')
+    parser.add_argument('--corpus', '-c', default=None, help='Measure on the N-grams of this corpus instead of random hashes')
+    parser.add_argument('--limit', type=int, default=100000, help='Maximum number of functions (or random hashes) to measure on')
+    parser.add_argument('--flanking', '-f', action='store_true', help='Use flanking ngrams', default=False)
+    parser.add_argument('--strip', action='store_true', default=False)
+    parser.add_argument('--dry-run', action='store_true', default=False, help='Only report, do not save the filters')
+    args = parser.parse_args()
+    main(args)
@@ -1,27 +1,64 @@
-
 import argparse
 
 from ..corpus import Corpus
+from ..db import NGramDBMulti
 from ..vocab import Vocab
-from ..ngram import build_ngram_db_multi
+from ..ngram import build_ngram_dbs, build_vocab_and_ngram_dbs
+from ..spill import parse_memory
 
 
 def main(args):
     corpus = Corpus(args.input, full_strip=args.strip)
-    vocab = Vocab.load(args.vocab)
-    db = build_ngram_db_multi(corpus, vocab, args.type, args.size, args.topk, args.flanking)
-    db.save(args.output)
+    sizes = [int(x) for x in args.sizes.split(',')] if args.sizes is not None else [args.size]
+    max_memory = parse_memory(args.max_memory) if args.max_memory is not None else None
+
+    if args.build_vocab:
+        if args.update_vocab or max_memory is not None:
+            raise ValueError('--build-vocab cannot be combined with --update-vocab or --max-memory')
+
+        vocab, dbs = build_vocab_and_ngram_dbs(corpus, args.type, sizes, args.topk, args.flanking, args.nproc, args.chunk)
+    else:
+        vocab = Vocab.load(args.vocab)
+
+        if args.update_vocab:
+            # New labels are appended, so databases built with the old vocab stay valid
+            vocab.update(Vocab.build_vocab(corpus, args.type, args.nproc))
+
+        dbs = build_ngram_dbs(corpus, vocab, args.type, sizes, args.topk, args.flanking, max_memory, args.tmpdir, args.nproc, args.chunk)
+
+    if len(dbs) > 1 and '{size}' not in args.output:
+        dbs = [NGramDBMulti.merge(dbs)]
+
+    for db in dbs:
+        if args.filter_bits > 0:
+            db.build_filter(args.filter_bits)
+
+        # One file per size, e.g. ngram.{size}.db
+        db.save(args.output.format(size=db.size) if '{size}' in args.output else args.output, compact=args.compact)
+
+    # Written last, so a failed build leaves the vocab untouched and can be rerun
+    if args.build_vocab or args.update_vocab:
+        vocab.save(args.vocab)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('input', help='Path to input.jsonl (STRIDE format)')
-    parser.add_argument('vocab', help='Path to input.vocab')
-    parser.add_argument('output', help='Path to output.db')
+    parser.add_argument('vocab', help='Path to input.vocab (output with --build-vocab)')
+    parser.add_argument('output', help='Path to output.db (use {size} in the path to write one file per size)')
     parser.add_argument('--type', '-t', choices=['name', 'type'], default='name', help='Which type of db to build')
     parser.add_argument('--size', '-s', type=int, default=3, help='Ngram size')
+    parser.add_argument('--sizes', default=None, help='Comma separated list of ngram sizes to build in one pass (overrides --size)')
     parser.add_argument('--topk', '-k', type=int, default=5, help='Number of top-k targets to store')
     parser.add_argument('--flanking', '-f', action='store_true', help='Use flanking ngrams', default=False)
     parser.add_argument('--strip', action='store_true', default=False)
+    parser.add_argument('--filter-bits', type=float, default=0, help='Store a Bloom filter with this many bits per entry (0 to disable)')
+    parser.add_argument('--compact', action='store_true', default=False, help='Write the compact format (see stride.tools.convert_db)')
+    parser.add_argument('--build-vocab', action='store_true', default=False, help='Build the vocab in the same pass over the corpus and write it to the vocab path')
+    parser.add_argument('--update-vocab', action='store_true', default=False, help='Add the labels of input to the vocab file (for building delta databases)')
+    parser.add_argument('--nproc', '-p', type=int, default=None, help='Number of processes')
+    parser.add_argument('--chunk', type=int, default=64, help='Number of functions each worker reads per task')
+    parser.add_argument('--max-memory', default=None, help='Spill counts to disk to keep the build under this much memory (e.g. 8G)')
+    parser.add_argument('--tmpdir', default=None, help='Directory for spilled runs (default: system temp dir)')
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,137 @@
+import argparse
+from functools import partial
+import multiprocessing
+import shutil
+import tempfile
+
+from tqdm.auto import tqdm
+
+from ..corpus import Corpus
+from ..db import NGramDBMulti
+from ..partition import concat, load_job, map_task, reduce_task, write_job, write_slices
+from ..spill import parse_memory
+from ..vocab import Vocab
+
+
+def _map(args, task: int):
+    map_task(Vocab.load(args.vocab), args.workdir, task, args.tasks, parse_memory(args.max_memory))
+
+
+def _save(args, dbs):
+    if len(dbs) > 1 and '{size}' not in args.output:
+        dbs = [NGramDBMulti.merge(dbs)]
+
+    for db in dbs:
+        if args.filter_bits > 0:
+            db.build_filter(args.filter_bits)
+
+        # One file per size, e.g. ngram.{size}.db
+        path = args.output.format(size=db.size) if '{size}' in args.output else args.output
+        db.save(path, compact=args.compact)
+        print(db, '->', path)
+
+
+def cmd_plan(args):
+    sizes = [int(x) for x in args.sizes.split(',')]
+    write_job(args.workdir, args.type, sizes, args.topk, args.flanking, args.partitions, len(Vocab.load(args.vocab).entries))
+    write_slices(args.workdir, Corpus(args.input, full_strip=args.strip), args.chunk)
+
+
+def cmd_map(args):
+    _map(args, args.task)
+
+
+def cmd_reduce(args):
+    reduce_task(args.workdir, args.partition)
+
+
+def cmd_concat(args):
+    _save(args, concat(args.workdir))
+
+
+def cmd_run(args):
+    '''All steps on this machine, with worker processes standing in for nodes.'''
+    created = args.workdir is None
+    if created:
+        args.workdir = tempfile.mkdtemp(prefix='stride-build-', dir=args.tmpdir)
+    workdir = args.workdir
+
+    try:
+        cmd_plan(args)
+        args.tasks = args.nproc or multiprocessing.cpu_count()
+
+        with multiprocessing.Pool(processes=args.nproc) as pool:
+            for _ in tqdm(pool.imap_unordered(partial(_map, args), range(args.tasks)), total=args.tasks, desc='Map'):
+                pass
+
+            partitions = load_job(workdir)['partitions']
+            for _ in tqdm(pool.imap_unordered(partial(reduce_task, workdir), range(partitions)), total=partitions, desc='Reduce'):
+                pass
+
+        cmd_concat(args)
+    finally:
+        if created and not args.keep:
+            shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds N-gram databases in hash partitions, locally or spread over several nodes')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def build_options(p):
+        p.add_argument('--type', '-t', choices=['name', 'type'], default='name', help='Which type of db to build')
+        p.add_argument('--sizes', default='3', help='Comma separated list of ngram sizes')
+        p.add_argument('--topk', '-k', type=int, default=5, help='Number of top-k targets to store')
+        p.add_argument('--flanking', '-f', action='store_true', help='Use flanking ngrams', default=False)
+        p.add_argument('--partitions', '-P', type=int, default=64, help='Number of hash partitions')
+        p.add_argument('--strip', action='store_true', default=False)
+        p.add_argument('--chunk', type=int, default=64, help='Number of functions per corpus slice')
+
+    def map_options(p):
+        p.add_argument('--max-memory', default='1G', help='Memory for buffered records per map task before they are written out')
+
+    def output_options(p):
+        p.add_argument('--filter-bits', type=float, default=0, help='Store a Bloom filter with this many bits per entry (0 to disable)')
+        p.add_argument('--compact', action='store_true', default=False, help='Write the compact format (see stride.tools.convert_db)')
+
+    p = sub.add_parser('plan', help='Write the build settings and corpus slices to the work directory (once, before map)')
+    p.add_argument('input', help='Path to input.jsonl (STRIDE format), read by the map tasks at the same path')
+    p.add_argument('vocab', help='Path to input.vocab')
+    p.add_argument('workdir', help='Work directory shared by all steps')
+    build_options(p)
+    p.set_defaults(func=cmd_plan)
+
+    p = sub.add_parser('map', help='Count one share of the corpus slices')
+    p.add_argument('vocab', help='Path to input.vocab')
+    p.add_argument('workdir', help='Work directory shared by all steps')
+    p.add_argument('--task', type=int, required=True, help='Index of this map task')
+    p.add_argument('--tasks', type=int, required=True, help='Total number of map tasks')
+    map_options(p)
+    p.set_defaults(func=cmd_map)
+
+    p = sub.add_parser('reduce', help='Merge the runs of one partition (after all map tasks)')
+    p.add_argument('workdir', help='Work directory shared by all steps')
+    p.add_argument('--partition', type=int, required=True, help='Index of the partition')
+    p.set_defaults(func=cmd_reduce)
+
+    p = sub.add_parser('concat', help='Concatenate the partitions into the final databases (after all reduce tasks)')
+    p.add_argument('workdir', help='Work directory shared by all steps')
+    p.add_argument('output', help='Path to output.db (use {size} in the path to write one file per size)')
+    output_options(p)
+    p.set_defaults(func=cmd_concat)
+
+    p = sub.add_parser('run', help='Run every step locally')
+    p.add_argument('input', help='Path to input.jsonl (STRIDE format)')
+    p.add_argument('vocab', help='Path to input.vocab')
+    p.add_argument('output', help='Path to output.db (use {size} in the path to write one file per size)')
+    p.add_argument('--nproc', '-p', type=int, default=None, help='Number of processes (and map tasks)')
+    p.add_argument('--workdir', default=None, help='Work directory, kept after the build (default: a new directory in --tmpdir)')
+    p.add_argument('--tmpdir', default=None, help='Directory for the default work directory (default: system temp dir)')
+    p.add_argument('--keep', action='store_true', default=False, help='Keep the default work directory')
+    build_options(p)
+    map_options(p)
+    output_options(p)
+    p.set_defaults(func=cmd_run)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -8,7 +8,7 @@ from ..vocab import Vocab
 
 
 def main(args):
-    vocab = Vocab.build_vocab(Corpus(args.input), args.type)
+    vocab = Vocab.build_vocab(Corpus(args.input), args.type, args.nproc)
     vocab.save(args.output)
 
 
@@ -17,5 +17,6 @@ if __name__ == '__main__':
     parser.add_argument('input', help='Path to input.jsonl (STRIDE format)')
     parser.add_argument('output', help='Path to output.vocab')
     parser.add_argument('--type', '-t', choices=['name', 'type'], default='name', help='Which type of vocab to build')
+    parser.add_argument('--nproc', '-p', type=int, default=None, help='Number of processes')
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,83 @@
+import argparse
+import json
+import random
+import sys
+import time
+
+from ..lexer import Lexer
+from ..tokenizer import tokenize
+
+
+# Fragments for random snippets, biased towards the cases where the lexer
+# changes state (strings, comments, preprocessor, labels, function headers).
+_FRAGMENTS = [
+    'int', 'unsigned __int64', 'char *', 'struct foo', 'union bar', '_QWORD', 'void', 'const', 'static', '__fastcall',
+    'sub_401000', 'a1', 'v2', 'std::string', 'ns::fn', '@@var_0@@len@@', '@@a1@@buf@@', 'NULL', 'true', 'sizeof',
+    '(', ')', '{', '}', '[', ']', ';', ',', '.', '->', '::', ':', '?', '*', '&', '+', '-', '<<', '>>=', '...', '##',
+    '0', '-1', '0x1F', '0xFFFFFFFFLL', '0LL', '017', '0b101u', '1.5', '.5f', '1e-3', '0x1.8p3', "1'000", '3UL',
+    '"str"', 'L"wide"', 'u8"utf"', '"esc\\n\\"q\\x41"', '"unterminated', "'a'", "'\\n'", "'\\0'", "'",
+    '/* c */', '// line\n', '/* multi\nline */', '/* open', '\\\n',
+    '\n#include <stdio.h>\n', '\n#define X 1\n', '\n#if 0\ndead\n#endif\n', '\n  # pragma once\n', '\n#if 0\n#if 1\n#endif\n#else\n',
+    '\nlabel_1:\n', '\ncase 3:', 'default:', 'public:', 'goto LABEL_5;', 'return', 'while', 'if', 'else',
+    'int f(int a)\n{', 'int __cdecl main(int argc, char **argv)', ';\n', '\n', ' ', '\t', '\r\n', '$', '`', '\\u00e9',
+]
+
+
+def fuzz(rng: random.Random, length: int) -> str:
+    return ' '.join(rng.choice(_FRAGMENTS) for _ in range(rng.randint(1, length)))
+
+
+def load_functions(path: str):
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)['func']
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    functions = []
+    for path in args.input:
+        functions.extend(load_functions(path))
+    functions.extend(fuzz(rng, args.length) for _ in range(args.fuzz))
+
+    print('Checking %d functions' % len(functions))
+
+    start = time.perf_counter()
+    expected = [[tok[1] for tok in Lexer(code).get_tokens()] for code in functions]
+    slow = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = [tokenize(code) for code in functions]
+    fast = time.perf_counter() - start
+
+    mismatches = 0
+    for code, a, b in zip(functions, expected, actual):
+        if a == b:
+            continue
+
+        mismatches += 1
+        if mismatches <= args.show:
+            i = next((i for i, (x, y) in enumerate(zip(a, b)) if x != y), min(len(a), len(b)))
+            print('--- mismatch at token %d' % i)
+            print(repr(code))
+            print('  pygments:  %r' % a[max(0, i - 3):i + 3])
+            print('  tokenizer: %r' % b[max(0, i - 3):i + 3])
+
+    print('pygments:  %.3fs' % slow)
+    print('tokenizer: %.3fs (%.1fx)' % (fast, slow / max(fast, 1e-9)))
+    print('%d / %d mismatches' % (mismatches, len(functions)))
+
+    if mismatches > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares stride.tokenizer against the Pygments based Lexer')
+    parser.add_argument('input', nargs='*', help='VarCorpus jsonl files (uses the "func" field)')
+    parser.add_argument('--fuzz', type=int, default=0, help='Number of random snippets to add')
+    parser.add_argument('--length', type=int, default=40, help='Maximum number of fragments per random snippet')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--show', type=int, default=10, help='Number of mismatches to print')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,22 @@
+import argparse
+
+from ..db import NGramDBLayered, NGramDBMulti
+
+
+def main(args):
+    base = NGramDBMulti.load(args.base)
+    deltas = [NGramDBMulti.load(path) for path in args.deltas]
+
+    db = NGramDBLayered(base, deltas).compact()
+    print(db)
+    db.save(args.output, compact=args.compact)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Folds delta databases into their base database')
+    parser.add_argument('base', help='Path to the base ngram.db')
+    parser.add_argument('deltas', nargs='+', help='Path to delta databases built with the same sizes')
+    parser.add_argument('--output', '-o', required=True, help='Path to the compacted output.db (may be the base path)')
+    parser.add_argument('--compact', action='store_true', default=False, help='Write the compact format (see stride.tools.convert_db)')
+    args = parser.parse_args()
+    main(args)
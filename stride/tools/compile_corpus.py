@@ -0,0 +1,127 @@
+import argparse
+import json
+import os
+
+from tqdm.auto import tqdm
+import numpy as np
+
+from ..corpus import Corpus, CompiledCorpus
+
+
+class _Column(object):
+    '''Appends values of a single dtype to a raw binary file.'''
+    def __init__(self, out_dir, name, dtype):
+        self.f = open(os.path.join(out_dir, name + '.bin'), 'wb')
+        self.dtype = dtype
+        self.count = 0
+
+    def write(self, values):
+        arr = np.asarray(values, dtype=self.dtype)
+        self.f.write(arr.tobytes())
+        self.count += len(arr)
+
+    def close(self):
+        self.f.close()
+
+
+def compile_corpus(corpus: Corpus, out_dir: str):
+    '''
+    Writes a pre-tokenized binary corpus readable by CompiledCorpus.
+
+    Layout (all files are flat little-endian arrays named <name>.bin):
+        tokens, norm:          uint32 string IDs of the raw and normalized tokens
+        tok_offsets:           int64, function i owns tokens[tok_offsets[i]:tok_offsets[i+1]]
+        var_pos, var_offsets:  positions of the variable tokens in each function
+        labels.<kind>.*:       per-variable (var, label, human) entries and offsets
+        meta, meta_offsets:    JSON encoded meta of each function
+        index.json:            version, function count, label kinds and the string table
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+
+    strings = []
+    ids = {}
+
+    def intern(s):
+        i = ids.get(s)
+        if i is None:
+            i = ids[s] = len(strings)
+            strings.append(s)
+        return i
+
+    tokens = _Column(out_dir, 'tokens', np.uint32)
+    norm = _Column(out_dir, 'norm', np.uint32)
+    var_pos = _Column(out_dir, 'var_pos', np.uint32)
+    meta = _Column(out_dir, 'meta', np.uint8)
+
+    tok_offsets = [0]
+    var_offsets = [0]
+    meta_offsets = [0]
+
+    # kind -> (var, label, human, offsets)
+    labels = {}
+
+    count = 0
+    for entry in tqdm(corpus, desc='Compiling'):
+        tokens.write([intern(x) for x in entry.tokens])
+        norm.write([intern(x) for x in entry.stripped_tokens])
+        var_pos.write(entry.var_positions)
+
+        tok_offsets.append(tokens.count)
+        var_offsets.append(var_pos.count)
+
+        for kind, info in entry.raw['labels'].items():
+            if kind not in labels:
+                labels[kind] = (
+                    _Column(out_dir, 'labels.%s.var' % kind, np.uint32),
+                    _Column(out_dir, 'labels.%s.label' % kind, np.uint32),
+                    _Column(out_dir, 'labels.%s.human' % kind, np.uint8),
+                    [0] * (count + 1),
+                )
+
+            var, label, human, offsets = labels[kind]
+            var.write([intern(v) for v in info])
+            label.write([intern(x['label']) for x in info.values()])
+            human.write([x['human'] for x in info.values()])
+
+        count += 1
+        for var, _label, _human, offsets in labels.values():
+            offsets.append(var.count)
+
+        if 'meta' in entry.raw:
+            meta.write(np.frombuffer(json.dumps(entry.raw['meta']).encode('utf-8'), dtype=np.uint8))
+        meta_offsets.append(meta.count)
+
+    for col in [tokens, norm, var_pos, meta]:
+        col.close()
+
+    for name, offsets in [('tok_offsets', tok_offsets), ('var_offsets', var_offsets), ('meta_offsets', meta_offsets)]:
+        np.array(offsets, dtype=np.int64).tofile(os.path.join(out_dir, name + '.bin'))
+
+    for kind, (var, label, human, offsets) in labels.items():
+        var.close()
+        label.close()
+        human.close()
+        np.array(offsets, dtype=np.int64).tofile(os.path.join(out_dir, 'labels.%s.offsets.bin' % kind))
+
+    with open(os.path.join(out_dir, 'index.json'), 'w') as f:
+        json.dump({
+            'version': CompiledCorpus.VERSION,
+            'count': count,
+            'kinds': list(labels),
+            'strings': strings,
+        }, f)
+
+    return count
+
+
+def main(args):
+    count = compile_corpus(Corpus(args.input), args.output)
+    print('Compiled %d functions to %s' % (count, args.output))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', help='Path to input.jsonl (STRIDE format)')
+    parser.add_argument('output', help='Path to output directory')
+    args = parser.parse_args()
+    main(args)
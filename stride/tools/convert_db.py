@@ -0,0 +1,23 @@
+import argparse
+import os
+
+from ..db import NGramDBMulti
+
+
+def main(args):
+    db = NGramDBMulti.load(args.input)
+    print(db)
+    db.save(args.output, compact=not args.full)
+
+    before = os.path.getsize(args.input)
+    after = os.path.getsize(args.output)
+    print('%d -> %d bytes (%.2fx)' % (before, after, before / max(after, 1)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Converts a database to the compact format (or back with --full)')
+    parser.add_argument('input', help='Path to input.db')
+    parser.add_argument('output', help='Path to output.db')
+    parser.add_argument('--full', action='store_true', default=False, help='Write the full format instead')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,79 @@
+import argparse
+import json
+import threading
+import time
+
+import numpy as np
+
+from ..client import StrideClient
+
+
+def main(args):
+    with open(args.input, 'r') as f:
+        functions = [json.loads(line) for _, line in zip(range(args.limit), f)]
+
+    # Requests are dealt out round-robin over the functions
+    latencies = []
+    lock = threading.Lock()
+    counter = [0]
+
+    def worker():
+        client = StrideClient(args.host, args.port, args.unix)
+        local = []
+        while True:
+            with lock:
+                i = counter[0]
+                counter[0] += 1
+            if i >= args.requests:
+                break
+
+            batch = [functions[(i * args.batch + j) % len(functions)] for j in range(args.batch)]
+
+            start = time.perf_counter()
+            client.predict(batch)
+            local.append(time.perf_counter() - start)
+
+        client.close()
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    lat = np.array(latencies) * 1000
+    report = {
+        'requests': len(latencies),
+        'functions': len(latencies) * args.batch,
+        'concurrency': args.concurrency,
+        'seconds': elapsed,
+        'requests_per_sec': len(latencies) / elapsed,
+        'functions_per_sec': len(latencies) * args.batch / elapsed,
+        'latency_ms': {
+            'mean': float(lat.mean()),
+            'p50': float(np.percentile(lat, 50)),
+            'p90': float(np.percentile(lat, 90)),
+            'p99': float(np.percentile(lat, 99)),
+            'max': float(lat.max()),
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', help='Path to input.jsonl (STRIDE format) to draw functions from')
+    parser.add_argument('--host', default='127.0.0.1', help='Server address')
+    parser.add_argument('--port', type=int, default=8765, help='Server port')
+    parser.add_argument('--unix', default=None, help='Server unix socket')
+    parser.add_argument('--requests', '-n', type=int, default=1000, help='Number of requests to send')
+    parser.add_argument('--concurrency', '-c', type=int, default=8, help='Number of concurrent clients')
+    parser.add_argument('--batch', '-b', type=int, default=1, help='Functions per request')
+    parser.add_argument('--limit', type=int, default=10000, help='Maximum number of functions to load from input')
+    args = parser.parse_args()
+    main(args)
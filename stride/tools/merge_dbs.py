@@ -0,0 +1,19 @@
+import argparse
+
+from ..db import NGramDBMulti
+
+
+def main(args):
+    dbs = [NGramDBMulti.load(path) for path in args.dbs]
+    db = NGramDBMulti.merge(dbs)
+    print(db)
+    db.save(args.output, compact=args.compact)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('output', help='Path to output.db')
+    parser.add_argument('dbs', nargs='+', help='Path to ngram.N.db files to merge')
+    parser.add_argument('--compact', action='store_true', default=False, help='Write the compact format (see stride.tools.convert_db)')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,121 @@
+import argparse
+import os
+import time
+
+from tqdm.auto import tqdm
+
+from ..corpus import Corpus
+from ..db import NGramDBMulti
+from ..predict import predict_batch
+from ..prune import parent_links, prune_cascade
+from ..vocab import Vocab
+
+
+def evaluate(corpus: Corpus, vocab: Vocab, variants, label: str, flanking: bool, batch: int = 64):
+    '''
+    Predicts every function with each list of databases in variants. Returns
+    the number of labelled variables, the number predicted correctly with
+    each variant and the number of predictions which differ from variants[0].
+    '''
+    total = 0
+    correct = [0] * len(variants)
+    changed = [0] * len(variants)
+
+    def run(entries):
+        nonlocal total
+        preds = [predict_batch(entries, vocab, dbs, label, flanking) for dbs in variants]
+        for k, entry in enumerate(entries):
+            labels = entry.labels(label)
+            for var in preds[0][k]:
+                if not labels[var].human:
+                    continue
+                total += 1
+                for j, p in enumerate(preds):
+                    correct[j] += p[k][var] == labels[var].label
+                    changed[j] += p[k][var] != preds[0][k][var]
+
+    entries = []
+    for entry in tqdm(corpus, desc='Evaluating'):
+        entries.append(entry)
+        if len(entries) == batch:
+            run(entries)
+            entries = []
+    run(entries)
+
+    return total, correct, changed
+
+
+def _nbytes(db: NGramDBMulti) -> int:
+    return sum(x.nbytes for x in (db.hsh, db.total, db.typ, db.counts))
+
+
+def main(args):
+    loaded = [NGramDBMulti.load(path) for path in args.dbs]
+    dbs = {size: db.split(size) for db in loaded for size in db.sizes}
+    sizes = sorted(dbs, reverse=True)
+    print('Sizes: %s' % ','.join(str(x) for x in sizes))
+
+    corpus = Corpus(args.input, full_strip=args.strip)
+    links = parent_links(corpus, sizes, args.flanking, args.nproc, args.chunk)
+
+    support_sizes = [int(x) for x in args.support_sizes.split(',')] if args.support_sizes is not None else None
+    thresholds = [args.min_total] + [int(x) for x in args.sweep.split(',') if x] if args.sweep else [args.min_total]
+
+    results = [prune_cascade(dbs, links, t, support_sizes) for t in thresholds]
+    pruned = results[0].subset(dbs)
+
+    print()
+    print('%6s %12s %12s %12s %12s' % ('size', 'entries', 'redundant', 'support', 'kept'))
+    for size in sizes:
+        r = results[0]
+        print('%6d %12d %12d %12d %12d' % (size, len(dbs[size].hsh), r.redundant[size], r.support[size], len(pruned[size].hsh)))
+
+    before = sum(_nbytes(db) for db in dbs.values())
+    after = sum(_nbytes(db) for db in pruned.values())
+    print('%d -> %d bytes in memory (%.2fx)' % (before, after, before / max(after, 1)))
+
+    if args.eval is not None:
+        vocab = Vocab.load(args.vocab)
+        variants = [[dbs[size] for size in sizes]] + [[db[size] for size in sizes] for db in (r.subset(dbs) for r in results)]
+        names = ['original'] + ['min-total %d' % t for t in thresholds]
+
+        start = time.perf_counter()
+        total, correct, changed = evaluate(Corpus(args.eval, full_strip=args.strip), vocab, variants, args.type, args.flanking)
+        print('Evaluated %d variables in %.1fs' % (total, time.perf_counter() - start))
+
+        print()
+        print('%-16s %12s %12s %10s %10s' % ('', 'entries', 'bytes', 'accuracy', 'changed'))
+        for name, dbs_, c, ch in zip(names, variants, correct, changed):
+            print('%-16s %12d %12d %10.4f %10d' % (
+                name, sum(len(db.hsh) for db in dbs_), sum(_nbytes(db) for db in dbs_), c / max(total, 1), ch,
+            ))
+
+    if args.output is not None:
+        out = [pruned[size] for size in sizes]
+        if '{size}' not in args.output:
+            out = [NGramDBMulti.merge(out)]
+
+        for db in out:
+            path = args.output.format(size=db.size) if '{size}' in args.output else args.output
+            db.save(path, compact=args.compact)
+            print('Wrote %s (%d bytes)' % (path, os.path.getsize(path)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Removes database entries which cannot change a prediction or have too little support')
+    parser.add_argument('input', help='Path to the training corpus the databases were built from (STRIDE format)')
+    parser.add_argument('--dbs', '-d', nargs='+', required=True, help='Databases of the backoff cascade (single or multi-size)')
+    parser.add_argument('--output', '-o', default=None, help='Path to output.db (use {size} in the path to write one file per size)')
+    parser.add_argument('--flanking', '-f', action='store_true', help='Use flanking ngrams', default=False)
+    parser.add_argument('--strip', action='store_true', default=False)
+    parser.add_argument('--min-total', type=int, default=1, help='Also remove entries seen fewer than this many times')
+    parser.add_argument('--support-sizes', default=None, help='Comma separated sizes the --min-total threshold applies to (default: all)')
+    parser.add_argument('--sweep', default=None, help='Comma separated extra --min-total values to report (not written)')
+    parser.add_argument('--eval', default=None, help='Held-out corpus to report the accuracy of each variant on')
+    parser.add_argument('--vocab', default=None, help='Path to label.vocab (needed for --eval)')
+    parser.add_argument('--type', '-t', choices=['name', 'type'], default='name', help='Label type')
+    parser.add_argument('--compact', action='store_true', default=False, help='Write the compact format (see stride.tools.convert_db)')
+    parser.add_argument('--nproc', '-p', type=int, default=None, help='Number of processes')
+    parser.add_argument('--chunk', type=int, default=64, help='Number of functions each worker reads per task')
+    args = parser.parse_args()
+    main(args)
@@ -1,31 +1,74 @@
 
 import argparse
+from contextlib import nullcontext
+import json
 import multiprocessing
+import multiprocessing.util
+import os
+import time
 
 from tqdm.auto import tqdm
-import pandas as pd
 
-from ..db import NGramDBMulti
-from ..corpus import Corpus, Entry
+from ..db import NGramDBMulti, with_deltas
+from ..corpus import Corpus, CorpusSlice, Entry
 from ..vocab import Vocab
 from ..predict import predict_multi
+from ..cache import PredictionCache, fingerprint
+from ..profile import Profile
+from ..results import open_writer
 
 
 
-def init(args):
-    global dbs, vocab, typ, flanking
+def _load_dbs(args, mmap: bool):
     dbs = [
-        NGramDBMulti.load(path)
+        NGramDBMulti.load(path, mmap=mmap)
         for path in args.dbs
     ]
+    return with_deltas(dbs, [NGramDBMulti.load(path) for path in args.deltas])
+
+
+def init(args):
+    global dbs, vocab, typ, flanking, cache, profiling
+    dbs = _load_dbs(args, args.mmap)
     vocab = Vocab.load(args.vocab)
     typ = args.type
     flanking = args.flanking
+    profiling = args.profile
+
+    cache = None
+    if args.cache_size > 0 or args.cache is not None:
+        cache = PredictionCache(args.fingerprint, args.cache_size, args.cache)
+        # Runs when the worker exits after pool.close()
+        multiprocessing.util.Finalize(cache, cache.close, exitpriority=10)
 
 
 def predict_one(entry: Entry):
-    global dbs, vocab, typ, flanking
-    p = predict_multi(entry, vocab, dbs, typ, flanking)
+    global dbs, vocab, typ, flanking, cache, profiling
+    profile = None
+    timer = lambda stage: nullcontext()
+    if profiling:
+        profile = Profile()
+        timer = profile.timer
+        start = time.perf_counter()
+
+        # Normalize before the cache key so it is not counted as cache time
+        with timer('normalize'):
+            entry.stripped_tokens
+
+    if cache is not None:
+        with timer('cache'):
+            key = cache.key(entry)
+            p = cache.get(key)
+        if p is None:
+            p = predict_multi(entry, vocab, dbs, typ, flanking, profile)
+            with timer('cache'):
+                cache.put(key, p)
+        elif profile is not None:
+            # predict_batch counts the functions it predicts
+            profile.function(len(entry.tokens))
+            profile.counts['cache_hits'] += 1
+    else:
+        p = predict_multi(entry, vocab, dbs, typ, flanking, profile)
 
     # Filter to only human labels and attach the ground truth label and count.
 
@@ -36,42 +79,125 @@ def predict_one(entry: Entry):
         if lbl.human:
             preds.append((var, p[var], lbl.label, counts[var]))
 
-    return (preds, entry.meta)
+    if profile is None:
+        return (preds, entry.meta)
 
+    profile.times['worker'] += time.perf_counter() - start
+    return (preds, entry.meta, profile)
 
-def main(args):
-    corpus = Corpus(args.input, full_strip=args.strip)
 
-    with multiprocessing.Pool(processes=args.nproc, initializer=init, initargs=(args,)) as pool:
-        preds = list(tqdm(pool.imap_unordered(predict_one, corpus), desc='Predicting'))
+def predict_slice(part: CorpusSlice):
+    '''
+    Reads, parses and predicts a slice of the corpus in the worker. Returns
+    the predict_one results, plus the merged profile and the send time when
+    profiling.
+    '''
+    global profiling
+    if not profiling:
+        return ([predict_one(entry) for entry in part], None, None)
 
-    out = []
-    for inner, meta in preds:
-        for var, pred, label, count in inner:
-            item = {
-                'var': var,
-                'pred': pred,
-                'label': label,
-                'count': count,
-            }
-            item.update(meta)
-            out.append(item)
+    profile = Profile()
+    results = []
+    for entry in _timed(part, profile, 'parse'):
+        preds, meta, p = predict_one(entry)
+        profile.merge(p)
+        results.append((preds, meta))
 
-    df = pd.DataFrame(out)
-    df.to_csv(args.output, index=False)
+    return (results, profile, time.time())
+
+
+def _timed(it, profile: Profile, stage: str):
+    '''Wraps an iterator, adding the time spent in each next() to stage.'''
+    it = iter(it)
+    while True:
+        with profile.timer(stage):
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+        yield item
+
+
+def main(args):
+    corpus = Corpus(args.input, full_strip=args.strip)
 
-    print('Wrote %d predictions to %s' % (len(preds), args.output))
+    profile = None
+    timer = lambda stage: nullcontext()
+    if args.profile:
+        profile = Profile()
+        timer = profile.timer
+        start = time.perf_counter()
+
+    # Workers read and parse their own slices of the input
+    parts = corpus.split(args.chunk)
+
+    # The in-process cache only lives for this run over fixed databases. A
+    # persistent cache is keyed on a hash of every database row, computed
+    # once here rather than in each worker.
+    args.fingerprint = b''
+    if args.cache is not None:
+        args.fingerprint = fingerprint(Vocab.load(args.vocab), _load_dbs(args, True), args.type, args.flanking, args.strip)
+
+    nfuncs = 0
+
+    with open_writer(args.output) as writer:
+        with multiprocessing.Pool(processes=args.nproc, initializer=init, initargs=(args,)) as pool:
+            for results, worker_profile, sent in tqdm(pool.imap_unordered(predict_slice, parts), total=len(parts), desc='Predicting'):
+                if profile is not None:
+                    # Wall clock, since the worker's perf_counter is not comparable
+                    profile.times['ipc_return'] += max(0.0, time.time() - sent)
+                    profile.merge(worker_profile)
+
+                # Rows are written as they arrive, so memory does not grow with the corpus
+                with timer('write'):
+                    for inner, meta in results:
+                        for var, pred, label, count in inner:
+                            item = {
+                                'var': var,
+                                'pred': pred,
+                                'label': label,
+                                'count': count,
+                            }
+                            item.update(meta)
+                            writer.write(item)
+                nfuncs += len(results)
+
+            # Let the workers exit normally so they close their caches
+            pool.close()
+            pool.join()
+
+        if profile is not None:
+            profile.times['predict_wall'] += time.perf_counter() - start
+
+        with timer('write'):
+            writer.close()
+
+    print('Wrote %d predictions for %d functions to %s' % (writer.count, nfuncs, args.output))
+
+    if profile is not None:
+        report = profile.report()
+        report['nproc'] = args.nproc or os.cpu_count()
+        path = os.path.splitext(args.output)[0] + '.profile.json'
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Wrote profile to %s' % path)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('input', help='Path to input.jsonl (STRIDE format)')
     parser.add_argument('vocab', help='Path to label.vocab')
-    parser.add_argument('output', help='Path to output.csv')
+    parser.add_argument('output', help='Path to output.csv (or .jsonl, .parquet)')
     parser.add_argument('--dbs', '-d', nargs='+', help='Path to ngram.db')
+    parser.add_argument('--deltas', nargs='+', default=[], help='Delta databases to layer onto the --dbs with the same sizes')
     parser.add_argument('--type', '-t', choices=['name', 'type'], default='name', help='Label type')
     parser.add_argument('--nproc', '-p', type=int, default=None, help='Number of processes')
+    parser.add_argument('--chunk', type=int, default=16, help='Number of functions each worker reads per task')
     parser.add_argument('--flanking', '-f', action='store_true', help='Use flanking ngrams', default=False)
     parser.add_argument('--strip', action='store_true', default=False)
+    parser.add_argument('--cache-size', type=int, default=10000, help='Number of predictions to cache per worker for duplicate functions (0 to disable)')
+    parser.add_argument('--cache', default=None, help='Path to a persistent prediction cache (sqlite), shared across runs')
+    parser.add_argument('--mmap', action='store_true', help='Memory-map the databases (shared between workers)', default=False)
+    parser.add_argument('--profile', action='store_true', help='Write per-stage timings and hit counts to <output>.profile.json', default=False)
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,134 @@
+import argparse
+import itertools
+import json
+import time
+
+from ..corpus import Corpus
+from ..db import NGramDBMulti
+from ..tune import Cascade, pareto
+from ..vocab import Vocab
+
+
+def _nbytes(db: NGramDBMulti) -> int:
+    return sum(x.nbytes for x in (db.hsh, db.total, db.typ, db.counts))
+
+
+def search(cascade: Cascade, nbytes, max_subsets: int):
+    '''
+    Evaluates every subset of the sizes if there are at most max_subsets of
+    them. Otherwise starts from all sizes and greedily drops the size whose
+    removal costs the least accuracy, evaluating each candidate on the way.
+    '''
+    n = len(cascade.sizes)
+    seen = {}
+
+    def run(mask):
+        mask = tuple(mask)
+        if mask not in seen:
+            point = cascade.evaluate(mask)
+            point['bytes'] = sum(b for b, m in zip(nbytes, mask) if m)
+            seen[mask] = point
+        return seen[mask]
+
+    if 2 ** n - 1 <= max_subsets:
+        for mask in itertools.product([True, False], repeat=n):
+            if any(mask):
+                run(mask)
+        return list(seen.values())
+
+    mask = [True] * n
+    run(mask)
+    while sum(mask) > 1:
+        best = None
+        for j in range(n):
+            if not mask[j]:
+                continue
+            cand = list(mask)
+            cand[j] = False
+            point = run(cand)
+            key = (point['accuracy'], -point['lookups'], -point['bytes'])
+            if best is None or key > best[0]:
+                best = (key, cand)
+        mask = best[1]
+
+    return list(seen.values())
+
+
+def recommend(points, objective: str, tolerance: float):
+    '''The cheapest point within tolerance of the best accuracy.'''
+    other = 'bytes' if objective == 'lookups' else 'lookups'
+    best = max(p['accuracy'] for p in points)
+    ok = [p for p in points if p['accuracy'] >= best - tolerance]
+    return min(ok, key=lambda p: (p[objective], p[other], len(p['sizes']), -p['accuracy']))
+
+
+def main(args):
+    loaded = [NGramDBMulti.load(path) for path in args.dbs]
+    dbs = {size: db.split(size) if len(db.sizes) > 1 else db for db in loaded for size in db.sizes}
+    paths = {size: path for db, path in zip(loaded, args.dbs) if len(db.sizes) == 1 for size in db.sizes}
+    sizes = sorted(dbs, reverse=True)
+    print('Sizes: %s' % ','.join(str(x) for x in sizes))
+
+    vocab = Vocab.load(args.vocab)
+    corpus = Corpus(args.input, full_strip=args.strip)
+
+    start = time.perf_counter()
+    cascade = Cascade.collect(corpus, vocab, [dbs[size] for size in sizes], args.type, args.flanking)
+    print('Looked up %d positions of %d variables in %.1fs' % (len(cascade.pos_var), len(cascade.var_names), time.perf_counter() - start))
+
+    start = time.perf_counter()
+    points = search(cascade, [_nbytes(dbs[size]) for size in sizes], args.max_subsets)
+    print('Evaluated %d subsets in %.1fs' % (len(points), time.perf_counter() - start))
+
+    full = points[0]
+    front = sorted(pareto(points), key=lambda p: (p['lookups'], p['bytes']))
+    rec = recommend(points, args.objective, args.tolerance)
+
+    print()
+    print('%-24s %10s %10s %12s %10s' % ('sizes', 'accuracy', 'lookups', 'bytes', 'missed'))
+    for p in front:
+        print('%-24s %10.4f %10.3f %12d %10d%s' % (
+            ','.join(str(x) for x in p['sizes']), p['accuracy'], p['lookups'], p['bytes'], p['unresolved'],
+            '  (all)' if p is full else '  <-' if p is rec else '',
+        ))
+
+    print()
+    print('Resolved by size (recommended):')
+    for size in rec['sizes']:
+        print('%6d %10d' % (size, rec['resolved'].get(size, 0)))
+
+    print()
+    print('Recommended (%s, within %.4f of the best accuracy): %.4f accuracy, %.3f lookups per position, %d bytes (all sizes: %.4f, %.3f, %d)' % (
+        args.objective, args.tolerance, rec['accuracy'], rec['lookups'], rec['bytes'], full['accuracy'], full['lookups'], full['bytes'],
+    ))
+    if all(size in paths for size in rec['sizes']):
+        print('--dbs %s' % ' '.join(paths[size] for size in rec['sizes']))
+    else:
+        print('Sizes: %s (split the multi-size databases, or merge these sizes, to use them)' % ','.join(str(x) for x in rec['sizes']))
+
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump({
+                'sizes': sizes,
+                'full': full,
+                'recommended': rec,
+                'pareto': front,
+                'points': points,
+            }, f, indent=2)
+        print('Wrote %s' % args.report)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Finds the subset of database sizes with the best accuracy per lookup and per byte')
+    parser.add_argument('input', help='Path to the validation corpus (STRIDE format)')
+    parser.add_argument('vocab', help='Path to label.vocab')
+    parser.add_argument('--dbs', '-d', nargs='+', required=True, help='Databases of the backoff cascade (single or multi-size)')
+    parser.add_argument('--type', '-t', choices=['name', 'type'], default='name', help='Label type')
+    parser.add_argument('--flanking', '-f', action='store_true', help='Use flanking ngrams', default=False)
+    parser.add_argument('--strip', action='store_true', default=False)
+    parser.add_argument('--objective', choices=['lookups', 'bytes'], default='lookups', help='Cost to minimize for the recommendation')
+    parser.add_argument('--tolerance', type=float, default=0.001, help='Accuracy the recommendation may give up against the best subset')
+    parser.add_argument('--max-subsets', type=int, default=4096, help='Search all subsets up to this many, greedy elimination beyond')
+    parser.add_argument('--report', '-o', default=None, help='Write every evaluated subset and the Pareto front to this JSON file')
+    args = parser.parse_args()
+    main(args)
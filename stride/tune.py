@@ -0,0 +1,163 @@
+from typing import List
+
+from tqdm.auto import tqdm
+import numpy as np
+
+from .db import NGramDBMulti
+from .predict import _aggregate, _all_sizes, predict_detailed
+from .vocab import Vocab
+
+
+class Cascade(object):
+    '''
+    The rows each size of a database cascade returns for every position of a
+    validation set (collected once with predict_detailed), so that the
+    predictions of any subset of the sizes can be replayed without further
+    lookups.
+
+    Sizes are ordered largest first. Masks select a subset of sizes.
+    '''
+    def __init__(self, vocab: Vocab, sizes: List[int], pos_var, row, typ, counts, var_fn, var_names, var_truth, var_human):
+        self.vocab = vocab
+        self.sizes = sizes
+        self.pos_var = pos_var
+        self.row = row
+        self.typ = typ
+        self.counts = counts
+        self.var_fn = var_fn
+        self.var_names = var_names
+        self.var_truth = var_truth
+        self.var_human = var_human
+        self.nfunctions = max(var_fn) + 1 if len(var_fn) > 0 else 0
+
+    def __repr__(self):
+        return f'Cascade(sizes={self.sizes}, positions={len(self.pos_var)}, variables={len(self.var_names)})'
+
+    @staticmethod
+    def collect(corpus: 'Corpus', vocab: Vocab, dbs: List[NGramDBMulti], label: str, flanking: bool = False) -> 'Cascade':
+        sizes = _all_sizes(dbs)
+        topk = max(db.topk for db in dbs)
+
+        pos_var = []
+        # (position, size) -> index into typ/counts, -1 for a miss
+        row = []
+        typ = []
+        counts = []
+
+        var_fn = []
+        var_names = []
+        var_truth = []
+        var_human = []
+
+        for k, entry in enumerate(tqdm(corpus, desc='Looking up')):
+            preds, locs = predict_detailed(entry, vocab, dbs, label, flanking)
+            labels = entry.labels(label)
+
+            local = {}
+            for var, idxs in locs.items():
+                local[var] = len(var_names)
+                var_fn.append(k)
+                var_names.append(var)
+                var_truth.append(labels[var].label)
+                var_human.append(labels[var].human)
+                for idx in idxs:
+                    local[idx] = local[var]
+
+            # Positions in the order predict_multi visits them
+            for idx, by_size in preds.items():
+                pos_var.append(local[idx])
+                for size in sizes:
+                    targets = by_size[size]
+                    if len(targets) == 0:
+                        row.append(-1)
+                        continue
+
+                    row.append(len(typ))
+                    t = np.zeros(topk, dtype=np.uint32)
+                    c = np.zeros(topk, dtype=np.uint32)
+                    for j, (name, count) in enumerate(targets):
+                        t[j] = vocab.lookup(name)
+                        c[j] = count
+                    typ.append(t)
+                    counts.append(c)
+
+        return Cascade(
+            vocab,
+            sizes,
+            np.array(pos_var, dtype=np.int64),
+            np.array(row, dtype=np.int64).reshape(-1, len(sizes)),
+            np.array(typ, dtype=np.uint32).reshape(-1, topk),
+            np.array(counts, dtype=np.uint32).reshape(-1, topk),
+            var_fn,
+            var_names,
+            var_truth,
+            np.array(var_human, dtype=bool),
+        )
+
+    def resolve(self, mask) -> np.ndarray:
+        '''Index of the size which resolves each position under backoff over the sizes in mask, -1 if none.'''
+        hit = (self.row >= 0) & np.asarray(mask, dtype=bool)[None, :]
+        first = hit.argmax(axis=1)
+        return np.where(hit.any(axis=1), first, -1)
+
+    def lookups(self, mask, resolved=None) -> np.ndarray:
+        '''Number of sizes each position is looked up in before it resolves (or all of them).'''
+        if resolved is None:
+            resolved = self.resolve(mask)
+        queried = np.cumsum(np.asarray(mask, dtype=np.int64))
+        return np.where(resolved >= 0, queried[resolved], queried[-1])
+
+    def predict(self, mask) -> List[dict]:
+        '''Same as predict_multi for every function, using only the sizes in mask.'''
+        resolved = self.resolve(mask)
+        npos, topk = len(self.pos_var), self.typ.shape[1]
+
+        typ = np.zeros((npos, topk), dtype=np.uint32)
+        counts = np.zeros((npos, topk), dtype=np.uint32)
+        hit = np.flatnonzero(resolved >= 0)
+        rows = self.row[hit, resolved[hit]]
+        typ[hit] = self.typ[rows]
+        counts[hit] = self.counts[rows]
+
+        out = [{} for _ in range(self.nfunctions)]
+        for k, var in zip(self.var_fn, self.var_names):
+            out[k][var] = None
+
+        if npos > 0:
+            _aggregate(out, typ, counts, self.pos_var, self.var_fn, self.var_names, self.vocab)
+        return out
+
+    def evaluate(self, mask) -> dict:
+        '''Accuracy over the human labelled variables, mean lookups per position and positions resolved per size.'''
+        preds = self.predict(mask)
+        correct = [
+            preds[k][var] == truth
+            for k, var, truth, human in zip(self.var_fn, self.var_names, self.var_truth, self.var_human)
+            if human
+        ]
+
+        resolved = self.resolve(mask)
+        return {
+            'sizes': [size for size, m in zip(self.sizes, mask) if m],
+            'accuracy': float(np.mean(correct)) if len(correct) > 0 else 0.0,
+            'lookups': float(self.lookups(mask, resolved).mean()) if len(resolved) > 0 else 0.0,
+            'resolved': {
+                int(size): int(n)
+                for size, n in zip(self.sizes, np.bincount(resolved[resolved >= 0], minlength=len(self.sizes)))
+                if n > 0
+            },
+            'unresolved': int((resolved < 0).sum()),
+        }
+
+
+def pareto(points: List[dict], keys=('accuracy', 'lookups', 'bytes')) -> List[dict]:
+    '''Points not dominated by any other: no lower accuracy, no higher lookups or bytes, and strictly better in one.'''
+    def better_or_equal(a, b):
+        return a[keys[0]] >= b[keys[0]] and all(a[k] <= b[k] for k in keys[1:])
+
+    front = []
+    for p in points:
+        if any(better_or_equal(q, p) and any(q[k] != p[k] for k in keys) for q in points):
+            continue
+        front.append(p)
+    return front
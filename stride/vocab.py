@@ -1,7 +1,10 @@
 
-from typing import List
+from functools import partial
+import multiprocessing
+from typing import Dict, List
 
 from tqdm.auto import tqdm
+import numpy as np
 
 if __package__ is None or __package__ == '':
     from corpus import Corpus
@@ -12,6 +15,7 @@ class Vocab(object):
         self.entries = entries
         self.counts = counts
         self.map = {e: i for i, e in enumerate(entries)}
+        self._count_array = None
 
     def __repr__(self):
         return f'Vocab(count={len(self.entries)})'
@@ -41,22 +45,29 @@ class Vocab(object):
     def count_by_id(self, id: int):
         return self.counts[id]
 
-    @staticmethod
-    def build_vocab(corpus: 'Corpus', typ: str) -> 'Vocab':
-        all_counts = {}
+    def update(self, other: 'Vocab'):
+        '''Adds the counts of another vocab. New entries are appended so existing ids stay valid.'''
+        for e, c in zip(other.entries, other.counts):
+            i = self.lookup(e)
+            if i is None:
+                self.map[e] = len(self.entries)
+                self.entries.append(e)
+                self.counts.append(c)
+            else:
+                self.counts[i] += c
+
+        self._count_array = None
 
-        for func in tqdm(corpus, desc='Building vocab'):
-            counts = func.var_counts()
-            labels = func.labels(typ)
-
-            for var in counts:
-                if not labels[var].human:
-                    continue
-                lbl = labels[var].label
-                if lbl not in all_counts:
-                    all_counts[lbl] = 0
-                all_counts[lbl] += counts[var]
-        
+    @property
+    def count_array(self):
+        '''Counts as a numpy array indexed by id.'''
+        if self._count_array is None:
+            self._count_array = np.array(self.counts, dtype=np.int64)
+        return self._count_array
+
+    @staticmethod
+    def from_counts(all_counts: Dict[str, int]) -> 'Vocab':
+        '''Builds a vocab sorted by count (ties keep the order of all_counts).'''
         pairs = [(k, v) for k, v in all_counts.items()]
         pairs.sort(key=lambda x: x[1], reverse=True)
 
@@ -67,3 +78,59 @@ class Vocab(object):
             counts.append(v)
 
         return Vocab(entries, counts)
+
+    @staticmethod
+    def build_vocab(corpus: 'Corpus', typ: str, nproc: int = None, chunk: int = 256) -> 'Vocab':
+        '''
+        Counts the human labels of a corpus. Slices of chunk functions are read
+        and counted in nproc worker processes (all cores by default, 1 to count
+        in this process) and merged in corpus order, so the result does not
+        depend on nproc.
+        '''
+        all_counts = {}
+
+        if nproc == 1:
+            results = map(partial(count_labels, typ=typ), corpus)
+            for counts in tqdm(results, desc='Building vocab'):
+                merge_counts(all_counts, counts)
+        else:
+            # Workers read and count whole slices of the corpus
+            parts = corpus.split(chunk)
+            with multiprocessing.Pool(processes=nproc) as pool:
+                results = pool.imap(partial(_count_slice, typ=typ), parts)
+                for counts in tqdm(results, total=len(parts), desc='Building vocab'):
+                    merge_counts(all_counts, counts)
+
+        return Vocab.from_counts(all_counts)
+
+
+def count_labels(func: 'Entry', typ: str) -> Dict[str, int]:
+    '''Returns label -> number of variable occurrences with that human label in one function.'''
+    counts = func.var_counts()
+    labels = func.labels(typ)
+
+    out = {}
+    for var in counts:
+        if not labels[var].human:
+            continue
+        lbl = labels[var].label
+        if lbl not in out:
+            out[lbl] = 0
+        out[lbl] += counts[var]
+
+    return out
+
+
+def _count_slice(part: 'CorpusSlice', typ: str) -> Dict[str, int]:
+    counts = {}
+    for func in part:
+        merge_counts(counts, count_labels(func, typ))
+    return counts
+
+
+def merge_counts(all_counts: Dict[str, int], counts: Dict[str, int]):
+    '''Adds label counts (see count_labels) into all_counts in place.'''
+    for lbl, c in counts.items():
+        if lbl not in all_counts:
+            all_counts[lbl] = 0
+        all_counts[lbl] += c
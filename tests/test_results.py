@@ -0,0 +1,78 @@
+import csv
+import json
+import os
+import tempfile
+import unittest
+
+from stride.results import ParquetWriter, open_writer
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+ROWS = [
+    {'var': 'v0', 'pred': 'a', 'id': 0},
+    {'var': 'v1', 'pred': 'b', 'id': 1, 'fit': 'x'},
+    {'var': 'v2', 'pred': 'c', 'id': 2},
+]
+
+
+def _write(writer, rows):
+    with writer:
+        for row in rows:
+            writer.write(row)
+
+
+class LateColumnTest(unittest.TestCase):
+    '''Meta keys that first show up after the first row become columns in every format.'''
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def test_csv(self):
+        _write(open_writer(self.path('out.csv')), ROWS)
+        with open(self.path('out.csv'), newline='') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(list(rows[0]), ['var', 'pred', 'id', 'fit'])
+        self.assertEqual([r['fit'] for r in rows], ['', 'x', ''])
+
+    def test_jsonl(self):
+        _write(open_writer(self.path('out.jsonl')), ROWS)
+        with open(self.path('out.jsonl')) as f:
+            self.assertEqual([json.loads(line) for line in f], ROWS)
+
+    @unittest.skipIf(pq is None, 'needs pyarrow')
+    def test_parquet(self):
+        _write(open_writer(self.path('out.parquet')), ROWS)
+        table = pq.read_table(self.path('out.parquet'))
+        self.assertEqual(table.column_names, ['var', 'pred', 'id', 'fit'])
+        self.assertEqual(table.column('fit').to_pylist(), [None, 'x', None])
+
+    @unittest.skipIf(pq is None, 'needs pyarrow')
+    def test_parquet_chunks(self):
+        rows = [dict({'var': 'v%d' % i, 'id': i}, **({'extra': i} if i % 7 == 6 else {})) for i in range(1000)]
+        _write(ParquetWriter(self.path('out.parquet'), chunk_size=100), rows)
+        table = pq.read_table(self.path('out.parquet'))
+        self.assertEqual(table.column_names, ['var', 'id', 'extra'])
+        self.assertEqual(table.column('extra').to_pylist(), [r.get('extra') for r in rows])
+
+    @unittest.skipIf(pq is None, 'needs pyarrow')
+    def test_parquet_mixed_types(self):
+        # Mixed within a chunk, and int in one chunk but str in a later one
+        rows = [{'var': 'v0', 'a': 1}, {'var': 'v1', 'a': 'x'}, {'var': 'v2', 'b': 2}, {'var': 'v3', 'b': 'y'}]
+        _write(open_writer(self.path('out.parquet')), rows[:2])
+        self.assertEqual(pq.read_table(self.path('out.parquet')).column('a').to_pylist(), ['1', 'x'])
+
+        _write(ParquetWriter(self.path('out2.parquet'), chunk_size=1), rows[2:])
+        self.assertEqual(pq.read_table(self.path('out2.parquet')).column('b').to_pylist(), ['2', 'y'])
+
+
+if __name__ == '__main__':
+    unittest.main()